@@ -0,0 +1,125 @@
+"""
+Batched data augmentation for train.py, on whole float NCHW batches already
+on DEVICE: no per-sample PIL/cv2 work in the data loader workers.
+brightness / contrast jitter, shadow overlays (a darkened side of a random
+line across the frame), small shifts and horizontal flips with the steering
+label negated. Random draws come from a seeded torch.Generator on DEVICE.
+Set options on the train.py command line, e.g.
+python train.py 2022-02-22-22-22 --augment flip_prob=0.5 max_shift=4
+Run this file to time it, e.g. python augment.py 125
+"""
+import sys
+import torch
+import torch.nn.functional as F
+
+DEFAULTS = {
+    'brightness': .25,  # scale by U(1 - b, 1 + b)
+    'contrast': .25,  # blend with the frame mean by U(1 - c, 1 + c)
+    'shadow_prob': .3,
+    'shadow_strength': .5,  # darken by up to this fraction
+    'max_shift': 6.,  # pixels, both directions
+    'flip_prob': .5,
+    'seed': 0,
+}
+
+
+def parse_options(options):
+    """
+    ['key=value', ...] from the command line -> DEFAULTS with these replaced.
+    """
+    config = dict(DEFAULTS)
+    for option in options:
+        key, _, value = option.partition('=')
+        if key not in DEFAULTS:
+            raise ValueError(f"Unknown augmentation option: {key}, choose from {list(DEFAULTS)}")
+        config[key] = int(value) if key == 'seed' else float(value)
+    return config
+
+
+class BatchAugment:
+    def __init__(self, device='cpu', **config):
+        self.config = dict(DEFAULTS, **config)
+        self.device = torch.device(device)
+        self.generator = torch.Generator(device=self.device)
+        self.generator.manual_seed(int(self.config['seed']))
+        self._grids = {}  # base sampling grid per (n, h, w), reused between batches
+
+    def _uniform(self, n, low, high):
+        return torch.rand(n, device=self.device, generator=self.generator) * (high - low) + low
+
+    def _chance(self, n, prob):
+        return torch.rand(n, device=self.device, generator=self.generator) < prob
+
+    def _base_grid(self, n, h, w):
+        key = (n, h, w)
+        if key not in self._grids:
+            theta = torch.eye(2, 3, device=self.device).expand(n, 2, 3)
+            self._grids[key] = F.affine_grid(theta, (n, 1, h, w), align_corners=False)
+        return self._grids[key]
+
+    def __call__(self, feature, target):
+        """
+        feature: float (N, C, H, W) in [0, 1], target: (N, 2) steering, throttle.
+        Returns new tensors, the inputs are not modified.
+        """
+        cfg = self.config
+        n, _, h, w = feature.shape
+        memory_format = torch.channels_last if feature.is_contiguous(memory_format=torch.channels_last) \
+            and not feature.is_contiguous() else torch.contiguous_format
+        x = feature
+        # brightness and contrast, one pass: ((x - mean) * contrast + mean) * gain
+        if cfg['brightness'] or cfg['contrast']:
+            gain = self._uniform(n, 1 - cfg['brightness'], 1 + cfg['brightness']).view(n, 1, 1, 1)
+            contrast = self._uniform(n, 1 - cfg['contrast'], 1 + cfg['contrast']).view(n, 1, 1, 1)
+            mean = x.mean(dim=(1, 2, 3), keepdim=True)
+            x = torch.addcmul(gain * mean * (1 - contrast), x, gain * contrast)
+        # shadow: darken the left side of a line from (top_x, 0) to (bottom_x, h)
+        if cfg['shadow_prob']:
+            cols = torch.linspace(0, 1, w, device=self.device).view(1, 1, 1, w)
+            rows = torch.linspace(0, 1, h, device=self.device).view(1, 1, h, 1)
+            top_x = self._uniform(n, 0, 1).view(n, 1, 1, 1)
+            bottom_x = self._uniform(n, 0, 1).view(n, 1, 1, 1)
+            in_shadow = cols < top_x + (bottom_x - top_x) * rows
+            strength = self._uniform(n, 0, cfg['shadow_strength']) * self._chance(n, cfg['shadow_prob'])
+            x = x * (1 - strength.view(n, 1, 1, 1) * in_shadow)  # (n, 1, h, w) mask, shared by channels
+        # shift, edge pixels are repeated
+        if cfg['max_shift']:
+            shift = torch.stack([
+                self._uniform(n, -cfg['max_shift'], cfg['max_shift']) * 2 / w,
+                self._uniform(n, -cfg['max_shift'], cfg['max_shift']) * 2 / h,
+            ], dim=-1).view(n, 1, 1, 2)
+            grid = self._base_grid(n, h, w) + shift
+            x = F.grid_sample(x, grid, mode='bilinear', padding_mode='border', align_corners=False)
+        if x is feature:  # everything below works in place
+            x = x.clone()
+        # horizontal flip of the chosen samples only, steering changes sign
+        if cfg['flip_prob']:
+            flip = self._chance(n, cfg['flip_prob'])
+            x[flip] = x[flip].flip(-1)
+            target = target.clone()
+            target[flip, 0] = -target[flip, 0]
+        return x.clamp_(0, 1).contiguous(memory_format=memory_format), target
+
+
+if __name__ == '__main__':
+    from time import perf_counter
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 125
+    feature = torch.rand(batch_size, 3, 120, 160, device=device)
+    target = torch.rand(batch_size, 2, device=device) * 2 - 1
+    toggles = ('brightness', 'contrast', 'shadow_prob', 'max_shift', 'flip_prob')
+    for name in ('all', *toggles):
+        # all augmentations together, then one at a time
+        config = DEFAULTS if name == 'all' else {k: (0 if k in toggles and k != name else v) for k, v in DEFAULTS.items()}
+        augment = BatchAugment(device, **config)
+        augment(feature, target)  # warm up
+        if device == "cuda":
+            torch.cuda.synchronize()
+        start_stamp = perf_counter()
+        for _ in range(20):
+            augment(feature, target)
+        if device == "cuda":
+            torch.cuda.synchronize()
+        elapsed = (perf_counter() - start_stamp) / 20
+        print(f"{name:>16}: {1000 * elapsed:.2f} ms per batch of {batch_size}, "
+              f"{batch_size / elapsed:.0f} samples/sec on {device}")
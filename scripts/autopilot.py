@@ -1,152 +1,167 @@
+from startup import StartupTimer
+timer = StartupTimer()  # first thing, so the report covers the imports
 import sys
 import os
 import json
-from time import time
-import torch
-from torchvision import transforms
-import convnets
-import serial
-import pygame
-import cv2 as cv
-from picamera2 import Picamera2
-from gpiozero import LED
+import argparse
+import threading
+from time import time, sleep, perf_counter
+import pipeline
+import hardware
+import telemetry
 
 
 # SETUP
-# Load configs and init servo controller
-model_path = os.path.join(
-    os.path.dirname(sys.path[0]),
-    'models', 
-    'DonkeyNet-15epochs-0.001lr.pth'
-)
-to_tensor = transforms.ToTensor()
-model = convnets.DonkeyNet()
-model.load_state_dict(torch.load(model_path, map_location=torch.device('cpu')))
-model.eval()
+# Pass in model file name (in models/) and optionally the inference backend
+# e.g. python autopilot.py DonkeyNet-15epochs-0.001lr.pt torchscript
+# Run the whole control loop without the car on a recorded session, here at 3x real time:
+# python autopilot.py DonkeyNet-15epochs-0.001lr.pth --replay 2022-02-22-22-22 --fps 60
+# The camera settles while the model loads and warms up, a timing report follows the first command.
+# Stage latencies are reported every few seconds, --trace saves the last frames for ui.perfetto.dev
+parser = argparse.ArgumentParser(description="Drive the car with a trained model")
+parser.add_argument('model_name', nargs='?', default='DonkeyNet-15epochs-0.001lr.pth', help="model file in models/")
+parser.add_argument('backend', nargs='?', default=None, help="inference backend, guessed from file extension")
+parser.add_argument('--model', default=None,
+                    help="architecture of a .pth file (see convnets.MODELS), guessed from its name")
+parser.add_argument('--replay', help="session under data/ to feed fake hardware instead of the car")
+parser.add_argument('--fps', type=int, default=20, help="camera frame rate, replays can go faster than the car")
+parser.add_argument('--report-every', type=float, default=5., help="seconds between latency reports")
+parser.add_argument('--trace', help="write a Chrome trace (JSON) of the last frames here on exit")
+args = parser.parse_args()
+model_path = os.path.join(os.path.dirname(sys.path[0]), 'models', args.model_name)
 # Load configs
 params_file_path = os.path.join(sys.path[0], 'configs.json')
 params_file = open(params_file_path)
 params = json.load(params_file)
 # Constants
-STEERING_CENTER = params['steering_center']
-STEERING_RANGE = params['steering_range']
-THROTTLE_STALL = params['throttle_stall']
-THROTTLE_FWD_RANGE = params['throttle_fwd_range']
-THROTTLE_REV_RANGE = params['throttle_rev_range']
-THROTTLE_LIMIT = params['throttle_limit']
 PAUSE_BUTTON = params['record_btn']
 STOP_BUTTON = params['stop_btn']
-# Init LED
-headlight = LED(params['led_pin'])
-headlight.off()
-# Init serial port
-ser_pico = serial.Serial(port='/dev/ttyACM0', baudrate=115200)
-print(f"Pico is connected to port: {ser_pico.name}")
-# Init controller
-pygame.display.init()
-pygame.joystick.init()
-js = pygame.joystick.Joystick(0)
-# init camera
-cv.startWindowThread()
-cam = Picamera2()
-cam.configure(
-    cam.create_preview_configuration(
-        main={"format": 'RGB888', "size": (120, 160)},
-        controls={"FrameDurationLimits": (50000, 50000)},  # 20 FPS
-    )
-)
-cam.start()
-for i in reversed(range(60)):
-    frame = cam.capture_array()
-    # cv.imshow("Camera", frame)
-    # cv.waitKey(1)
-    if frame is None:
-        print("No frame received. TERMINATE!")
-        sys.exit()
-    if not i % 20:
-        print(i/20)  # count down 3, 2, 1 sec  
-# Init timer for FPS computing
-start_stamp = time()
-frame_counts = 0
-ave_frame_rate = 0.
+duty = hardware.DutyEncoder(params, max_action=.999)
+stage_times = telemetry.Telemetry(('capture', 'preprocess', 'infer', 'encode', 'serial write'))
+replay_dir = os.path.join(os.path.dirname(sys.path[0]), 'data', args.replay) if args.replay else None
+# Init LED, serial port, controller and camera, then let exposure settle, on a thread
+rig = None
+rig_ready = threading.Event()
+camera_status = {}
+
+
+def setup_rig():
+    global rig
+    try:
+        with timer.phase('open devices'):
+            rig = hardware.open_rig(params, replay=replay_dir, fps=args.fps)
+    except Exception as e:
+        camera_status['error'] = e
+        return
+    finally:
+        rig_ready.set()
+    if replay_dir:  # recorded frames, nothing to settle
+        camera_status['settled'] = True
+        return
+    try:
+        with timer.phase('camera settle'):
+            camera_status['settled'], camera_status['frames'] = rig.camera.settle()
+    except Exception as e:  # raised in the main thread after join()
+        camera_status['error'] = e
+
+
+rig_thread = threading.Thread(target=setup_rig, name='rig')
+rig_thread.start()
+# Meanwhile: import torch, load the model and warm it up
+with timer.phase('import torch'):
+    import inference
+with timer.phase('load model'):
+    model = inference.load_model(model_path, args.backend, model_name=args.model)
+    runner = inference.InferenceRunner(model, num_threads=2, num_buffers=3)
+rig_ready.wait()
+if 'error' in camera_status:
+    raise camera_status['error']
+with timer.phase('warm up model'):
+    runner.warm_up(rig.camera.frame_shape)
+if not replay_dir:
+    with timer.phase('import cv2'):
+        import cv2 as cv
+    cv.startWindowThread()
+rig_thread.join()
+if 'error' in camera_status:  # the camera failed while settling
+    rig.close()
+    raise camera_status['error']
+print(f"Pico is connected to port: {rig.drivetrain.name}")
+rig.drivetrain.attach(stage_times)
+if camera_status['settled'] is None:
+    print("No frame received. TERMINATE!")
+    rig.close()
+    sys.exit()
+if not camera_status['settled']:
+    print(f"Exposure still changing after {camera_status['frames']} frames, driving anyway")
 # Init variables
-is_paused = True
+is_paused = replay_dir is None  # replays drive right away
+is_first_command = True
+
+
+# PIPELINE STAGES
+def actuate(action):
+    global is_first_command
+    frame_id = pipe.frame_ids['actuate']
+    t0 = perf_counter()
+    if is_paused:
+        duty_st, duty_th = rig.drivetrain.neutral
+    else:
+        duty_st, duty_th = duty.encode(*action)
+    stage_times.record(frame_id, 'encode', t0, perf_counter())
+    # Transmit control signals, only the newest one if the link lags
+    rig.drivetrain.send(duty_st, duty_th, frame_id)
+    if is_first_command:
+        timer.mark('first command')
+        is_first_command = False
+
+
+def shutdown():
+    pipe.stop()
+    print(stage_times.report())
+    rig.close()
+    if args.trace:
+        num_events = stage_times.export_chrome_trace(args.trace)
+        print(f"{num_events} trace events saved to {args.trace}")
+    if not replay_dir:
+        cv.destroyAllWindows()
+    sys.exit()
+
+
+pipe = pipeline.ControlPipeline(
+    rig.camera.capture_array, runner.preprocess, runner.infer, actuate, stage_times, release_fn=runner.release,
+)
+pipe.start()
+last_report = time()
+is_reported = False
 
 
 # LOOP
 try:
     while True:
-        frame = cam.capture_array()  # read image
-        if frame is None:
-            print("No frame received. TERMINATE!")
-            headlight.close()
-            cv.destroyAllWindows()
-            pygame.quit()
-            ser_pico.close()
-            sys.exit()
-        for e in pygame.event.get():  # read controller input
-            if e.type == pygame.JOYBUTTONDOWN:
-                if js.get_button(PAUSE_BUTTON):
-                    is_paused = not is_paused
-                    print(f"Paused: {is_paused}")
-                    headlight.toggle()
-                elif js.get_button(STOP_BUTTON):  # emergency stop 
-                    print("E-STOP PRESSED. TERMINATE!")
-                    headlight.off()
-                    headlight.close()
-                    cv.destroyAllWindows()
-                    pygame.quit()
-                    sys.exit()
-        # predict steer and throttle
-        img_tensor = to_tensor(frame)
-        pred_st, pred_th = model(img_tensor[None, :]).squeeze()
-        st_trim = float(pred_st)
-        if st_trim >= 1:  # trim steering signal
-            st_trim = .999
-        elif st_trim <= -1:
-            st_trim = -.999
-        th_trim = (float(pred_th))
-        if th_trim >= 1:  # trim throttle signal
-            th_trim = .999
-        elif th_trim <= -1:
-            th_trim = -.999
-        # Encode steering value to dutycycle in nanosecond
-        if is_paused:
-            duty_st = STEERING_CENTER
-        else:
-            duty_st = STEERING_CENTER - STEERING_RANGE + int(STEERING_RANGE * (st_trim + 1))
-        # Encode throttle value to dutycycle in nanosecond
-        if is_paused:
-            duty_th = THROTTLE_STALL
-        else:
-            if th_trim > 0:
-                duty_th = THROTTLE_STALL + int(THROTTLE_FWD_RANGE * min(th_trim, THROTTLE_LIMIT))
-            elif th_trim < 0:
-                duty_th = THROTTLE_STALL + int(THROTTLE_REV_RANGE * max(th_trim, -THROTTLE_LIMIT))
-            else:
-                duty_th = THROTTLE_STALL
-        msg = (str(duty_st) + "," + str(duty_th) + "\n").encode('utf-8')
-        # Transmit control signals
-        ser_pico.write(msg)
-        print(f"predicted action: {pred_st, pred_th}")        
-        frame_counts += 1
-        # Log frame rate
-        since_start = time() - start_stamp
-        frame_rate = frame_counts / since_start
-        print(f"frame rate: {frame_rate}")
-        if cv.waitKey(1)==ord('q'):
-            headlight.off()
-            headlight.close()
-            cv.destroyAllWindows()
-            pygame.quit()
-            ser_pico.close()
-            sys.exit()
- 
+        if not pipe.is_running():
+            print(f"Pipeline stopped: {pipe.error}. TERMINATE!")
+            shutdown()
+        if not is_first_command and not is_reported:
+            print(f"Startup:\n{timer.report()}")
+            is_reported = True
+        for button in rig.controller.update():  # read controller input
+            if button == PAUSE_BUTTON:
+                is_paused = not is_paused
+                print(f"Paused: {is_paused}")
+                rig.light.toggle()
+            elif button == STOP_BUTTON:  # emergency stop
+                print("E-STOP PRESSED. TERMINATE!")
+                shutdown()
+        # Log stage latencies every few seconds
+        if time() - last_report >= args.report_every:
+            last_report = time()
+            print(f"{stage_times.report()}\ndropped: {pipe.stats()['dropped']}, serial: {rig.drivetrain.stats()}")
+        if replay_dir:
+            sleep(.01)
+        elif cv.waitKey(10)==ord('q'):
+            shutdown()
+
 # Take care terminate signal (Ctrl-c)
 except KeyboardInterrupt:
-    headlight.off()
-    headlight.close()
-    cv.destroyAllWindows()
-    pygame.quit()
-    ser_pico.close()
-    sys.exit()
+    shutdown()
@@ -0,0 +1,76 @@
+"""
+Measure training data throughput (samples/sec, including the copy to DEVICE
+and float conversion) for different data loading configurations.
+--augment also times the cached, batch collated loader with the training
+augmentations of augment.py applied on DEVICE.
+e.g. python bench_loader.py 2022-02-22-22-22 --augment
+"""
+import os
+import sys
+import argparse
+from time import perf_counter
+import torch
+import augment
+import datasets
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def measure(dataset, num_batches, augmenter=None, **loader_kwargs):
+    """
+    Samples per second over num_batches, after one warm-up batch.
+    """
+    dataloader = datasets.make_dataloader(dataset, shuffle=True, **loader_kwargs)
+    num_samples = 0
+    start_stamp = None
+    for b, (im, st, th) in enumerate(dataloader):
+        if b == 1:  # worker start-up is not throughput
+            start_stamp = perf_counter()
+            num_samples = 0
+        feature = im.to(DEVICE, non_blocking=True)
+        target = torch.stack((st, th), dim=-1).to(DEVICE, non_blocking=True)
+        if feature.dtype == torch.uint8:
+            feature = datasets.frames_to_float(feature)
+        if augmenter is not None:
+            feature, target = augmenter(feature, target)
+        num_samples += target.shape[0]
+        if b == num_batches:
+            break
+    if DEVICE == "cuda":
+        torch.cuda.synchronize()
+    return num_samples / (perf_counter() - start_stamp) if start_stamp else 0.
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark data loading for train.py")
+    parser.add_argument('data_datetime', help="session under data/, e.g. 2022-02-22-22-22")
+    parser.add_argument('--batch-size', type=int, default=125)
+    parser.add_argument('--num-batches', type=int, default=20)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4])
+    parser.add_argument('--augment', nargs='*', metavar='KEY=VALUE',
+                        help="also measure with augmentation on, options as in train.py")
+    args = parser.parse_args()
+    data_dir = os.path.join(os.path.dirname(sys.path[0]), 'data', args.data_datetime)
+    print(f"Using {DEVICE} device")
+
+    configs = [('jpeg', False, False, False)]  # the original setup: decode every sample
+    configs += [('cache', False, pin, False) for pin in (False, True)]
+    configs += [('cache', True, pin, False) for pin in (False, True)]
+    if args.augment is not None:
+        configs += [('cache', True, pin, True) for pin in (False, True)]
+    for source, batch_collate, pin_memory, augmented in configs:
+        if pin_memory and DEVICE != "cuda":
+            continue  # pinning only helps host to GPU copies
+        dataset = datasets.load_session(data_dir, use_cache=source == 'cache', raw=batch_collate)
+        for num_workers in args.workers:
+            rate = measure(
+                dataset,
+                args.num_batches,
+                augment.BatchAugment(DEVICE, **augment.parse_options(args.augment)) if augmented else None,
+                batch_size=args.batch_size,
+                num_workers=num_workers,
+                pin_memory=pin_memory,
+                batch_collate=batch_collate,
+            )
+            print(f"source: {source:>5}, batch collate: {batch_collate!s:>5}, pin memory: {pin_memory!s:>5}, "
+                  f"augment: {augmented!s:>5}, workers: {num_workers} -> {rate:.0f} samples/sec")
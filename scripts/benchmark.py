@@ -0,0 +1,204 @@
+"""
+Replay a recorded session through the autopilot's driving path, no hardware:
+camera frame -> InferenceRunner.preprocess -> model -> DutyEncoder, one frame
+after another in recording order, so runs are comparable.
+Reports throughput, per stage latency, memory and prediction vs label error.
+--save writes the results as the baseline under benchmarks/, later runs are
+compared against it and exit with 1 if anything got worse by more than
+--tolerance.
+e.g. python benchmark.py 2022-02-22-22-22 DonkeyNet-15epochs-0.001lr.pt --save
+"""
+import os
+import sys
+import json
+import platform
+import resource
+import argparse
+from time import perf_counter
+import numpy as np
+import torch
+import inference
+import hardware
+import telemetry
+import recorders
+
+STAGES = ('capture', 'preprocess', 'infer', 'encode')
+# metric -> True if higher is better
+CHECKS = {
+    'throughput_fps': True,
+    'latency_p50_ms': False,
+    'latency_p95_ms': False,
+    'replay_peak_rss_mb': False,
+    'mse': False,
+}
+
+
+def rss_mb():
+    """
+    Current resident memory of this process.
+    """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def reset_peak_rss():
+    """
+    Restart the kernel's resident memory high-water mark (VmHWM) from the
+    current RSS, False if this kernel does not allow it.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """
+    Resident memory high-water mark of this process since start or the last reset_peak_rss().
+    """
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def replay(camera, runner, duty, num_frames, stage_times, frame_id=0):
+    """
+    Run num_frames through the driving path, return predictions and wall time.
+    """
+    predictions = np.empty((num_frames, 2), dtype=np.float32)
+    start_stamp = perf_counter()
+    for i in range(num_frames):
+        t0 = perf_counter()
+        frame = camera.capture_array()
+        t1 = perf_counter()
+        img_tensor = runner.preprocess(frame)
+        t2 = perf_counter()
+        action = runner.infer(img_tensor)
+        t3 = perf_counter()
+        duty.encode(*action)
+        t4 = perf_counter()
+        for name, start, end in zip(STAGES, (t0, t1, t2, t3), (t1, t2, t3, t4)):
+            stage_times.record(frame_id + i, name, start, end)
+        predictions[i] = action
+    return predictions, perf_counter() - start_stamp
+
+
+def run(session_dir, model_path, backend=None, num_frames=None, num_warmup=20, repeat=3, num_threads=2):
+    params = json.load(open(os.path.join(sys.path[0], 'configs.json')))
+    duty = hardware.DutyEncoder(params, max_action=.999)
+    model = inference.load_model(model_path, backend, num_threads=num_threads)
+    runner = inference.InferenceRunner(model, num_threads=num_threads)
+    camera = hardware.ReplayCamera(session_dir, fps=0)
+    num_frames = min(num_frames or len(camera), len(camera))
+    labels = np.asarray(camera.session.labels, dtype=np.float32)[:num_frames, :2]
+    runner.warm_up(camera.frame_shape, num_warmup)
+    stage_times = telemetry.Telemetry(STAGES, capacity=num_frames * repeat)
+    process_peak = peak_rss_mb()  # includes loading the model and the session
+    is_reset = reset_peak_rss()
+    rss_before = rss_mb()
+    rates = []
+    for r in range(repeat):
+        camera.rewind()  # every repeat replays the same frames
+        predictions, elapsed = replay(camera, runner, duty, num_frames, stage_times, r * num_frames)
+        rates.append(num_frames / elapsed)
+    summary = stage_times.summary()
+    errors = predictions - labels
+    return {
+        'session': os.path.basename(os.path.normpath(session_dir)),
+        'model': os.path.basename(model_path),
+        'backend': backend or inference.guess_backend(model_path),
+        'frames': num_frames,
+        'repeat': repeat,
+        'throughput_fps': float(np.median(rates)),
+        'latency_p50_ms': summary['latency']['p50'],
+        'latency_p95_ms': summary['latency']['p95'],
+        'latency_p99_ms': summary['latency']['p99'],
+        'stage_p50_ms': {name: summary[name]['p50'] for name in STAGES},
+        'process_peak_rss_mb': max(process_peak, peak_rss_mb()),
+        # high-water mark of the replays alone, None if the kernel cannot reset it
+        'replay_peak_rss_mb': peak_rss_mb() if is_reset else None,
+        'rss_growth_mb': rss_mb() - rss_before,  # per frame allocations that are never freed show up here
+        'mse': float((errors ** 2).mean()),
+        'mae_steering': float(np.abs(errors[:, 0]).mean()),
+        'mae_throttle': float(np.abs(errors[:, 1]).mean()),
+        'machine': {
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'threads': num_threads,
+        },
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    (metric, baseline, now, change, regressed) for every checked metric.
+    """
+    rows = []
+    for metric, higher_is_better in CHECKS.items():
+        old, new = baseline.get(metric), results[metric]
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else 0.
+        worse = -change if higher_is_better else change
+        rows.append((metric, old, new, change, worse > tolerance))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline replay benchmark of the driving path")
+    parser.add_argument('data_datetime', help="session under data/, e.g. 2022-02-22-22-22")
+    parser.add_argument('model_name', nargs='?', default='DonkeyNet-15epochs-0.001lr.pth', help="model file in models/")
+    parser.add_argument('--backend', default=None, help="inference backend, guessed from file extension")
+    parser.add_argument('--frames', type=int, default=None, help="replay only the first frames")
+    parser.add_argument('--warmup', type=int, default=20, help="untimed inferences before the replay")
+    parser.add_argument('--repeat', type=int, default=3, help="replays, throughput is the median")
+    parser.add_argument('--threads', type=int, default=2, help="CPU threads for inference")
+    parser.add_argument('--baseline', default=None, help="baseline name, defaults to <model>-<session>")
+    parser.add_argument('--save', action='store_true', help="save this run as the baseline")
+    parser.add_argument('--tolerance', type=float, default=.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+    root = os.path.dirname(sys.path[0])
+    session_dir = os.path.join(root, 'data', args.data_datetime)
+    model_path = os.path.join(root, 'models', args.model_name)
+    baseline_name = args.baseline or f"{os.path.splitext(args.model_name)[0]}-{args.data_datetime}"
+    baseline_path = os.path.join(root, 'benchmarks', baseline_name + '.json')
+
+    results = run(session_dir, model_path, args.backend, args.frames, args.warmup, args.repeat, args.threads)
+    print(f"{results['model']} ({results['backend']}) on {results['session']}, "
+          f"{results['frames']} frames x {results['repeat']}")
+    print(f"throughput: {results['throughput_fps']:.1f} frames/s")
+    print(f"latency ms: p50 {results['latency_p50_ms']:.2f}, p95 {results['latency_p95_ms']:.2f}, "
+          f"p99 {results['latency_p99_ms']:.2f}, stages p50 "
+          + ', '.join(f"{k} {v:.2f}" for k, v in results['stage_p50_ms'].items()))
+    replay_peak = results['replay_peak_rss_mb']
+    print(f"memory: process peak rss {results['process_peak_rss_mb']:.0f} MB, replay peak rss "
+          f"{'n/a' if replay_peak is None else f'{replay_peak:.0f} MB'}, "
+          f"growth during replay {results['rss_growth_mb']:.1f} MB")
+    print(f"error vs labels: mse {results['mse']:.4f}, "
+          f"mae steering {results['mae_steering']:.4f}, throttle {results['mae_throttle']:.4f}")
+
+    is_regressed = False
+    if os.path.isfile(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline['machine'] != results['machine']:
+            print(f"Baseline was measured on {baseline['machine']}, timings may not compare")
+        if (baseline['frames'], baseline['backend']) != (results['frames'], results['backend']):
+            print(f"Baseline replayed {baseline['frames']} frames with {baseline['backend']}, results may not compare")
+        print(f"vs baseline {baseline_name}:")
+        for metric, old, new, change, regressed in compare(results, baseline, args.tolerance):
+            is_regressed |= regressed
+            print(f"  {metric:<16} {old:10.4f} -> {new:10.4f} ({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    elif not args.save:
+        print(f"No baseline {baseline_name} yet, save one with --save")
+    if args.save:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        recorders.write_json_atomic(baseline_path, results)
+        print(f"Baseline saved to {baseline_path}")
+    sys.exit(1 if is_regressed and not args.save else 0)
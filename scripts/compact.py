@@ -0,0 +1,200 @@
+"""
+Compact a recorded session: drop frames recorded while the car stood still
+and collapse runs of near-identical frames (stalled, or going straight) into
+one frame each.
+Frames are compared through small grayscale thumbnails, computed a chunk at
+a time from the memory-mapped frames (binary recording or frame cache, see
+datasets.py and recorders.py), so a 100k frame session takes seconds.
+A frame is redundant if its thumbnail and labels are both close to the last
+frame kept. Each kept frame records how many frames it stands for in
+weights.npy, train.py samples it by that run length ** --run-power (see
+samplers.py): runs of near-duplicates are down-weighted, not erased.
+Writes the compacted session in the binary layout of recorders.BinaryRecorder
+to data/<datetime>-compact/ with a report in compact.json, e.g.
+python compact.py 2022-02-22-22-22 --threshold 2 --zero-throttle 0.05
+"""
+import os
+import sys
+import shutil
+import argparse
+from time import perf_counter
+import numpy as np
+import datasets
+import recorders
+import samplers
+
+THUMB_SHAPE = (12, 16)  # rows, columns sampled from every frame
+CHUNK_FRAMES = 1000  # frames per output chunk, as BinaryRecorder writes them
+READ_FRAMES = 4096  # frames read per step while computing thumbnails
+
+
+def open_frames(data_dir):
+    """
+    Memory-mapped frames of a session as [(first index, frames)] and its
+    (N, 3) steering, throttle, timestamp labels (timestamp NaN if not recorded).
+    """
+    if recorders.is_binary_session(data_dir) and not os.path.isfile(os.path.join(data_dir, 'labels.csv')):
+        session = recorders.RecordedSession(data_dir)
+        return list(session.chunks()), np.asarray(session.labels, dtype=np.float32)
+    frames_path, labels_path = datasets.build_cache(
+        os.path.join(data_dir, 'labels.csv'),
+        os.path.join(data_dir, 'images'),
+        os.path.join(data_dir, 'cache'),
+    )
+    labels = np.load(labels_path)
+    labels = np.column_stack([labels, np.full(len(labels), np.nan, dtype=np.float32)])
+    return [(0, np.load(frames_path, mmap_mode='r'))], labels
+
+
+def thumbnails(chunks, shape=THUMB_SHAPE):
+    """
+    (N, rows, cols) float32 grayscale thumbnails, read by strided sampling of
+    the memory maps, only the sampled pixel rows are touched.
+    """
+    num_frames = sum(len(frames) for _, frames in chunks)
+    thumbs = np.empty((num_frames,) + shape, dtype=np.float32)
+    for offset, frames in chunks:
+        rows = np.linspace(0, frames.shape[1] - 1, shape[0]).round().astype(np.intp)
+        cols = np.linspace(0, frames.shape[2] - 1, shape[1]).round().astype(np.intp)
+        for start in range(0, len(frames), READ_FRAMES):
+            block = frames[start:start + READ_FRAMES, rows][:, :, cols]  # (n, rows, cols, 3) uint8
+            thumbs[offset + start:offset + start + len(block)] = block.mean(axis=-1, dtype=np.float32)
+    return thumbs
+
+
+def select(thumbs, labels, threshold=2., label_tolerance=.02, zero_throttle=.05):
+    """
+    Indices of the frames to keep, the number of frames each one stands for
+    and the masks of stalled and redundant frames.
+    threshold: mean absolute thumbnail difference, in 0-255 gray levels.
+    """
+    stalled = np.abs(labels[:, 1]) < zero_throttle
+    moving = np.flatnonzero(~stalled)
+    redundant = np.zeros(len(labels), dtype=bool)
+    weights = np.zeros(len(labels), dtype=np.int64)
+    if len(moving):
+        # distance to the previous moving frame, vectorized: frames far from
+        # it are kept without comparing them to the last kept frame
+        flat = thumbs[moving].reshape(len(moving), -1)
+        step = np.abs(np.diff(flat, axis=0)).mean(axis=1)
+        step_label = np.abs(np.diff(labels[moving, :2], axis=0)).max(axis=1)
+        is_new = np.concatenate([[True], (step > threshold) | (step_label > label_tolerance)])
+        positions = np.arange(len(moving))
+        prev_new = np.maximum.accumulate(np.where(is_new, positions, 0))
+        kept = 0
+        for i in np.flatnonzero(~is_new).tolist():
+            # close to its neighbour, check the drift since the last kept frame
+            kept = max(kept, prev_new[i])
+            if (np.abs(flat[i] - flat[kept]).mean() > threshold
+                    or np.abs(labels[moving[i], :2] - labels[moving[kept], :2]).max() > label_tolerance):
+                is_new[i] = True
+                kept = i
+        kept_positions = np.flatnonzero(is_new)
+        weights[moving[kept_positions]] = np.diff(np.append(kept_positions, len(moving)))
+        redundant[moving[~is_new]] = True
+    keep = np.flatnonzero(weights)
+    return keep, weights[keep], stalled, redundant
+
+
+def write_session(out_dir, chunks, labels, keep):
+    """
+    Copy the kept frames into a new session in the BinaryRecorder layout.
+    """
+    offsets = np.array([offset for offset, _ in chunks])
+    frame_shape = chunks[0][1].shape[1:]
+    index = {
+        'version': 1,
+        'frame_shape': list(frame_shape),
+        'chunk_frames': CHUNK_FRAMES,
+        'count': len(keep),
+        'start_time': 0.,
+        'chunks': [],
+    }
+    for chunk_id, start in enumerate(range(0, len(keep), CHUNK_FRAMES)):
+        part = keep[start:start + CHUNK_FRAMES]
+        names = {'frames': f'frames-{chunk_id:05d}.npy', 'labels': f'labels-{chunk_id:05d}.npy', 'count': len(part)}
+        frames_out = np.lib.format.open_memmap(
+            os.path.join(out_dir, names['frames']), mode='w+', dtype=np.uint8, shape=(CHUNK_FRAMES,) + frame_shape,
+        )
+        source = np.searchsorted(offsets, part, side='right') - 1
+        for c in np.unique(source):  # one fancy-indexed read per source chunk
+            mask = source == c
+            frames_out[np.flatnonzero(mask)] = chunks[c][1][part[mask] - offsets[c]]
+        frames_out.flush()
+        del frames_out
+        labels_out = np.zeros((CHUNK_FRAMES, 3), dtype=np.float32)
+        labels_out[:len(part)] = labels[part]
+        np.save(os.path.join(out_dir, names['labels']), labels_out)
+        index['chunks'].append(names)
+    recorders.write_json_atomic(os.path.join(out_dir, recorders.INDEX_FILE), index)
+
+
+def compact(data_dir, out_dir, threshold=2., label_tolerance=.02, zero_throttle=.05, force=False):
+    """
+    Write the compacted session to out_dir. An existing out_dir is only
+    replaced if an earlier compaction wrote it (has compact.json) or with force.
+    """
+    if os.path.exists(out_dir) and not force and not os.path.isfile(os.path.join(out_dir, 'compact.json')):
+        raise FileExistsError(f"{out_dir} exists and is not an earlier compaction, pass force=True (--force) to replace it")
+    t0 = perf_counter()
+    chunks, labels = open_frames(data_dir)
+    thumbs = thumbnails(chunks)
+    t1 = perf_counter()
+    keep, weights, stalled, redundant = select(thumbs, labels, threshold, label_tolerance, zero_throttle)
+    t2 = perf_counter()
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)  # an earlier compaction, or --force
+    os.makedirs(out_dir)
+    write_session(out_dir, chunks, labels, keep)
+    np.save(os.path.join(out_dir, samplers.RUN_WEIGHTS_FILE), weights)
+    t3 = perf_counter()
+    frame_bytes = int(np.prod(chunks[0][1].shape[1:]))
+    report = {
+        'source': os.path.basename(os.path.normpath(data_dir)),
+        'frames_in': len(labels),
+        'frames_out': len(keep),
+        'dropped_stalled': int(stalled.sum()),
+        'dropped_redundant': int(redundant.sum()),
+        'kept_fraction': len(keep) / len(labels) if len(labels) else 0.,
+        'frame_mb_in': len(labels) * frame_bytes / 2**20,
+        'frame_mb_out': len(keep) * frame_bytes / 2**20,
+        'max_weight': int(weights.max()) if len(weights) else 0,
+        'settings': {'threshold': threshold, 'label_tolerance': label_tolerance, 'zero_throttle': zero_throttle},
+        'seconds': {'thumbnails': t1 - t0, 'select': t2 - t1, 'write': t3 - t2},
+    }
+    recorders.write_json_atomic(os.path.join(out_dir, 'compact.json'), report)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Drop stalled and near-duplicate frames from a session")
+    parser.add_argument('data_datetime', help="session under data/, e.g. 2022-02-22-22-22")
+    parser.add_argument('--out', default=None, help="output session name, defaults to <data_datetime>-compact")
+    parser.add_argument('--threshold', type=float, default=2.,
+                        help="mean absolute thumbnail difference (gray levels) below which frames are redundant")
+    parser.add_argument('--label-tolerance', type=float, default=.02,
+                        help="largest steering/throttle change within a redundant run")
+    parser.add_argument('--zero-throttle', type=float, default=.05,
+                        help="frames with |throttle| below this are dropped, 0 keeps them")
+    parser.add_argument('--force', action='store_true',
+                        help="replace --out even if it is not an earlier compaction, e.g. a recorded session")
+    args = parser.parse_args()
+    data_root = os.path.join(os.path.dirname(sys.path[0]), 'data')
+    out_name = args.out or args.data_datetime + '-compact'
+    if out_name == args.data_datetime:
+        parser.error("--out must differ from the source session")
+    try:
+        report = compact(
+            os.path.join(data_root, args.data_datetime),
+            os.path.join(data_root, out_name),
+            args.threshold, args.label_tolerance, args.zero_throttle, args.force,
+        )
+    except FileExistsError as e:
+        parser.error(str(e))
+    print(f"{report['source']}: {report['frames_in']} -> {report['frames_out']} frames "
+          f"({report['kept_fraction']:.0%}), dropped {report['dropped_stalled']} stalled "
+          f"and {report['dropped_redundant']} redundant")
+    print(f"frames: {report['frame_mb_in']:.0f} MB -> {report['frame_mb_out']:.0f} MB, "
+          f"a kept frame stands for up to {report['max_weight']} frames")
+    print("seconds: " + ', '.join(f"{k} {v:.2f}" for k, v in report['seconds'].items()))
+    print(f"Compacted session saved to {os.path.join(data_root, out_name)}")
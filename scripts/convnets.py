@@ -1,4 +1,6 @@
+import os
 import torch.nn as nn
+from torch.ao.quantization import QuantStub, DeQuantStub, fuse_modules
 
 class DonkeyNet(nn.Module):
 
@@ -27,3 +29,143 @@ class DonkeyNet(nn.Module):
         x = self.relu(self.fc2(x))
         x = self.fc3(x)
         return x
+
+
+class QuantDonkeyNet(DonkeyNet):
+    """
+    DonkeyNet with quant/dequant stubs and one ReLU per layer, so that
+    conv+relu and linear+relu pairs can be fused for static INT8 quantization.
+    Loads the state_dict of a DonkeyNet as is.
+    """
+    def __init__(self):
+        super().__init__()
+        self.quant = QuantStub()
+        self.dequant = DeQuantStub()
+        self.relu24 = nn.ReLU()
+        self.relu32 = nn.ReLU()
+        self.relu64_5 = nn.ReLU()
+        self.relu64_3 = nn.ReLU()
+        self.relu_fc1 = nn.ReLU()
+        self.relu_fc2 = nn.ReLU()
+
+    def forward(self, x):
+        x = self.quant(x)
+        x = self.relu24(self.conv24(x))
+        x = self.relu32(self.conv32(x))
+        x = self.relu64_5(self.conv64_5(x))
+        x = self.relu64_3(self.conv64_3(x))
+        x = self.relu64_3(self.conv64_3(x))  # same layer applied twice, as in DonkeyNet
+
+        x = self.flatten(x)
+        x = self.relu_fc1(self.fc1(x))
+        x = self.relu_fc2(self.fc2(x))
+        x = self.fc3(x)
+        x = self.dequant(x)
+        return x
+
+    def fuse(self):
+        fuse_modules(
+            self,
+            [
+                ['conv24', 'relu24'],
+                ['conv32', 'relu32'],
+                ['conv64_5', 'relu64_5'],
+                ['conv64_3', 'relu64_3'],
+                ['fc1', 'relu_fc1'],
+                ['fc2', 'relu_fc2'],
+            ],
+            inplace=True,
+        )
+
+
+class NarrowDonkeyNet(nn.Module):
+    """
+    DonkeyNet with fewer channels, two distinct 3x3 convolutions and global
+    average pooling in front of the classifier, so any input of at least
+    about 64x64 works. width scales the channels.
+    """
+    def __init__(self, width=.5):
+        super().__init__()
+        c24, c32, c64 = (max(8, int(c * width)) for c in (24, 32, 64))
+        self.features = nn.Sequential(
+            nn.Conv2d(3, c24, kernel_size=5, stride=2), nn.ReLU(),
+            nn.Conv2d(c24, c32, kernel_size=5, stride=2), nn.ReLU(),
+            nn.Conv2d(c32, c64, kernel_size=5, stride=2), nn.ReLU(),
+            nn.Conv2d(c64, c64, kernel_size=3), nn.ReLU(),
+            nn.Conv2d(c64, c64, kernel_size=3), nn.ReLU(),
+        )
+        # global pooling exports to frozen TorchScript and ONNX at any input size,
+        # pooling to a fixed grid larger than 1x1 does not
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.head = nn.Sequential(
+            nn.Flatten(),
+            nn.Linear(c64, 64), nn.ReLU(),
+            nn.Linear(64, 2),
+        )
+
+    def forward(self, x):
+        return self.head(self.pool(self.features(x)))
+
+
+def separable(in_channels, out_channels, stride):
+    """
+    Depthwise 3x3 then pointwise 1x1 convolution, each with batch norm and ReLU6.
+    """
+    return nn.Sequential(
+        nn.Conv2d(in_channels, in_channels, kernel_size=3, stride=stride, padding=1, groups=in_channels, bias=False),
+        nn.BatchNorm2d(in_channels), nn.ReLU6(),
+        nn.Conv2d(in_channels, out_channels, kernel_size=1, bias=False),
+        nn.BatchNorm2d(out_channels), nn.ReLU6(),
+    )
+
+
+class MobileDonkeyNet(nn.Module):
+    """
+    MobileNet style: a strided stem and depthwise separable blocks, then
+    global average pooling, so the input size is free. width scales the channels.
+    """
+    # (output channels, stride) of the separable blocks
+    BLOCKS = ((32, 2), (64, 2), (64, 1), (128, 2), (128, 1))
+
+    def __init__(self, width=1.):
+        super().__init__()
+        channels = max(8, int(16 * width))
+        layers = [nn.Conv2d(3, channels, kernel_size=3, stride=2, padding=1, bias=False),
+                  nn.BatchNorm2d(channels), nn.ReLU6()]
+        for out_channels, stride in self.BLOCKS:
+            out_channels = max(8, int(out_channels * width))
+            layers.append(separable(channels, out_channels, stride))
+            channels = out_channels
+        self.features = nn.Sequential(*layers)
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.head = nn.Sequential(
+            nn.Flatten(),
+            nn.Dropout(.2),
+            nn.Linear(channels, 2),
+        )
+
+    def forward(self, x):
+        return self.head(self.pool(self.features(x)))
+
+
+# Models train.py and autopilot.py can build by name
+MODELS = {
+    'DonkeyNet': DonkeyNet,
+    'NarrowDonkeyNet': NarrowDonkeyNet,
+    'MobileDonkeyNet': MobileDonkeyNet,
+}
+
+
+def make_model(name='DonkeyNet'):
+    if name not in MODELS:
+        raise ValueError(f"Unknown model: {name}, choose from {list(MODELS)}")
+    return MODELS[name]()
+
+
+def guess_model_name(path):
+    """
+    Architecture of a model file named by train.py (<model>-<epochs>epochs-<lr>lr.pth),
+    DonkeyNet if the name does not tell.
+    """
+    prefix = os.path.basename(path).split('-')[0]
+    return prefix if prefix in MODELS else 'DonkeyNet'
@@ -0,0 +1,222 @@
+"""
+Datasets for training on recorded sessions.
+Decoding JPEGs every epoch is slow, so by default the frames of a session
+are decoded once into data/<datetime>/cache/ (a uint8 frames.npy plus a
+float32 labels.npy) and memory-mapped from there. The cache is rebuilt
+when labels.csv or any listed image changes.
+With raw=True samples are uint8 HWC arrays, collate_uint8() stacks them and
+frames_to_float() converts a whole batch at once, after it reached DEVICE.
+"""
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import Dataset, DataLoader, random_split
+from torchvision.transforms import v2
+import cv2 as cv
+import recorders
+
+CACHE_VERSION = 1
+
+
+def to_tensor(frame):
+    """
+    uint8 HWC array -> float32 CHW tensor in [0, 1], same as ToTensor().
+    """
+    return torch.from_numpy(np.ascontiguousarray(frame)).permute(2, 0, 1).float().div(255)
+
+
+def frames_to_float(frames, memory_format=torch.contiguous_format):
+    """
+    uint8 NHWC batch -> float32 NCHW batch in [0, 1], in one vectorized op.
+    """
+    return frames.permute(0, 3, 1, 2).to(dtype=torch.float32, memory_format=memory_format).div_(255)
+
+
+def collate_uint8(batch):
+    """
+    Stack raw samples without converting them, see frames_to_float().
+    """
+    frames, steering, throttle = zip(*batch)
+    return (
+        torch.from_numpy(np.stack(frames)),
+        torch.from_numpy(np.array(steering, dtype=np.float32)),
+        torch.from_numpy(np.array(throttle, dtype=np.float32)),
+    )
+
+
+def make_dataloader(dataset, batch_size=125, shuffle=False, num_workers=0, pin_memory=False,
+                    prefetch_factor=2, batch_collate=False, sampler=None):
+    """
+    DataLoader with parallel workers, pinned host memory and prefetching.
+    batch_collate expects a dataset created with raw=True.
+    sampler replaces shuffle, e.g. samplers.BalancedSampler.
+    """
+    kwargs = {}
+    if num_workers > 0:  # these only exist for multi-process loading
+        kwargs = {'persistent_workers': True, 'prefetch_factor': prefetch_factor}
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        sampler=sampler,
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        collate_fn=collate_uint8 if batch_collate else None,
+        **kwargs,
+    )
+
+
+def fingerprint(annotations_file, img_dir, image_names):
+    """
+    Hash of labels.csv content and the size/mtime of every listed image.
+    """
+    digest = hashlib.sha1()
+    with open(annotations_file, 'rb') as f:
+        digest.update(f.read())
+    for name in image_names:
+        st = os.stat(os.path.join(img_dir, name))
+        digest.update(f'{name}:{st.st_size}:{st.st_mtime_ns};'.encode())
+    digest.update(str(CACHE_VERSION).encode())
+    return digest.hexdigest()
+
+
+def build_cache(annotations_file, img_dir, cache_dir, num_workers=4):
+    """
+    Decode a session into cache_dir unless an up to date cache exists.
+    Returns paths of the frames and labels arrays.
+    """
+    img_labels = pd.read_csv(annotations_file)
+    image_names = img_labels.iloc[:, 0].tolist()
+    key = fingerprint(annotations_file, img_dir, image_names)
+    frames_path = os.path.join(cache_dir, 'frames.npy')
+    labels_path = os.path.join(cache_dir, 'labels.npy')
+    manifest_path = os.path.join(cache_dir, 'manifest.json')
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            if json.load(f).get('fingerprint') == key:
+                return frames_path, labels_path
+    print(f"Building frame cache in {cache_dir}")
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.path.isfile(manifest_path):
+        os.remove(manifest_path)  # invalid until the new cache is complete
+    first = cv.imread(os.path.join(img_dir, image_names[0]), cv.IMREAD_COLOR)
+    tmp_path = frames_path + '.tmp'
+    frames = np.lib.format.open_memmap(
+        tmp_path, mode='w+', dtype=np.uint8, shape=(len(image_names),) + first.shape
+    )
+
+    def decode(i):  # cv2 releases the GIL while decoding
+        frames[i] = cv.imread(os.path.join(img_dir, image_names[i]), cv.IMREAD_COLOR)
+
+    with ThreadPoolExecutor(num_workers) as pool:
+        list(pool.map(decode, range(len(image_names)), chunksize=64))
+    frames.flush()
+    del frames
+    os.replace(tmp_path, frames_path)
+    np.save(labels_path, img_labels.iloc[:, 1:3].to_numpy(dtype=np.float32))
+    recorders.write_json_atomic(manifest_path, {
+        'fingerprint': key,
+        'count': len(image_names),
+        'frame_shape': list(first.shape),
+    })
+    return frames_path, labels_path
+
+
+class BearCartDataset(Dataset):
+    """
+    Customized dataset
+    Pass cache_dir to read decoded frames from a memory-mapped cache.
+    """
+    def __init__(self, annotations_file, img_dir, cache_dir=None, raw=False):
+        self.img_dir = img_dir
+        self.cache_dir = cache_dir
+        self.raw = raw
+        if cache_dir is None:
+            self.img_labels = pd.read_csv(annotations_file)
+            self.transform = v2.ToTensor()
+        else:
+            self.frames_path, labels_path = build_cache(annotations_file, img_dir, cache_dir)
+            self.labels = np.load(labels_path)
+            self._frames = None  # opened lazily, so DataLoader workers each map it
+
+    def __len__(self):
+        if self.cache_dir is None:
+            return len(self.img_labels)
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        if self.cache_dir is not None:
+            if self._frames is None:
+                # copy-on-write map, torch.from_numpy() wants a writable array
+                self._frames = np.load(self.frames_path, mmap_mode='c')
+            steering, throttle = self.labels[idx]
+            frame = self._frames[idx]
+            return frame if self.raw else to_tensor(frame), steering, throttle
+        img_path = os.path.join(self.img_dir, self.img_labels.iloc[idx, 0])
+        image = cv.imread(img_path, cv.IMREAD_COLOR)
+        steering = self.img_labels.iloc[idx, 1].astype(np.float32)
+        throttle = self.img_labels.iloc[idx, 2].astype(np.float32)
+        if self.raw:
+            return image, steering, throttle
+        image_tensor = self.transform(image)
+        return image_tensor.float(), steering, throttle
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_frames'] = None  # never pickle the memory map itself
+        return state
+
+
+class RecordedDataset(Dataset):
+    """
+    Dataset over a binary session written by recorders.BinaryRecorder.
+    """
+    def __init__(self, session_dir, raw=False):
+        self.session_dir = session_dir
+        self.raw = raw
+        self.labels = recorders.RecordedSession(session_dir).labels[:, :2].copy()
+        self._session = None  # opened lazily, so DataLoader workers each map it
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        if self._session is None:
+            self._session = recorders.RecordedSession(self.session_dir)
+        steering, throttle = self.labels[idx]
+        frame = self._session.frame(idx)
+        return frame if self.raw else to_tensor(frame), steering, throttle
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_session'] = None
+        return state
+
+
+def load_session(data_dir, use_cache=True, raw=False):
+    """
+    Dataset for a session directory, whichever way it was recorded.
+    """
+    if recorders.is_binary_session(data_dir) and not os.path.isfile(os.path.join(data_dir, 'labels.csv')):
+        return RecordedDataset(data_dir, raw=raw)
+    return BearCartDataset(
+        os.path.join(data_dir, 'labels.csv'),  # the name of the csv file
+        os.path.join(data_dir, 'images'),  # the name of the folder with all the images in it
+        cache_dir=os.path.join(data_dir, 'cache') if use_cache else None,
+        raw=raw,
+    )
+
+
+def split_dataset(dataset, test_fraction=.1, seed=0):
+    """
+    Train and test subsets of an indexed dataset. Seeded, so train.py, a
+    resumed run and quantize.py all hold out the same frames.
+    """
+    train_size = round(len(dataset) * (1 - test_fraction))
+    return random_split(
+        dataset, [train_size, len(dataset) - train_size], generator=torch.Generator().manual_seed(seed)
+    )
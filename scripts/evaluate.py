@@ -0,0 +1,141 @@
+"""
+Score trained models on recorded sessions without driving the car.
+Frames are decoded once (memory-mapped frame cache, see datasets.py),
+loaded in large uint8 batches by worker processes and converted to float
+once per batch, then every model runs on the same batch. Eager models run
+in channels_last, which is faster for convolutions on CPU.
+Writes per frame predictions to data/<datetime>/eval/<model>.csv and a
+summary with MSE, MAE and error histograms to data/<datetime>/eval/summary.json.
+e.g. python evaluate.py 2022-02-22-22-22 2022-03-03-33-33 --models DonkeyNet-15epochs-0.001lr.pth DonkeyNet-15epochs-0.001lr.pt
+"""
+import os
+import sys
+import json
+import argparse
+from time import perf_counter
+import numpy as np
+import torch
+import datasets
+import inference
+import recorders
+
+HIST_RANGE = (-2., 2.)  # actions are in [-1, 1], so are errors within [-2, 2]
+
+
+def memory_format(model):
+    """
+    channels_last for eager torch models, TorchScript and ONNX keep their layout.
+    """
+    if isinstance(model, torch.nn.Module) and not isinstance(model, torch.jit.ScriptModule):
+        return torch.channels_last
+    return torch.contiguous_format
+
+
+def predict(dataset, models, batch_size=1024, num_workers=2):
+    """
+    Predictions of every model, {name: (num_frames, 2) array}, and the labels.
+    """
+    dataloader = datasets.make_dataloader(
+        dataset,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        prefetch_factor=2,
+        batch_collate=True,
+    )
+    predictions = {name: np.empty((len(dataset), 2), dtype=np.float32) for name in models}
+    labels = np.empty((len(dataset), 2), dtype=np.float32)
+    formats = {name: memory_format(model) for name, model in models.items()}
+    start = 0
+    with torch.inference_mode():
+        for im, st, th in dataloader:
+            features = {  # converted once per layout, shared by all models
+                fmt: datasets.frames_to_float(im, fmt) for fmt in set(formats.values())
+            }
+            end = start + len(im)
+            labels[start:end, 0] = st.numpy()
+            labels[start:end, 1] = th.numpy()
+            for name, model in models.items():
+                predictions[name][start:end] = model(features[formats[name]]).numpy()
+            start = end
+    return predictions, labels
+
+
+def score(pred, labels, num_bins=40):
+    errors = pred - labels
+    summary = {
+        'mse': float((errors ** 2).mean()),
+        'mse_steering': float((errors[:, 0] ** 2).mean()),
+        'mse_throttle': float((errors[:, 1] ** 2).mean()),
+        'mae_steering': float(np.abs(errors[:, 0]).mean()),
+        'mae_throttle': float(np.abs(errors[:, 1]).mean()),
+    }
+    for i, name in enumerate(('steering', 'throttle')):
+        counts, edges = np.histogram(errors[:, i], bins=num_bins, range=HIST_RANGE)
+        summary[f'hist_{name}'] = {'counts': counts.tolist(), 'edges': edges.tolist()}
+    return summary
+
+
+def save_predictions(path, pred, labels):
+    table = np.column_stack([np.arange(len(labels)), labels, pred])
+    np.savetxt(path, table, fmt=['%d', '%.4f', '%.4f', '%.6f', '%.6f'], delimiter=',', comments='',
+               header='frame,steering,throttle,pred_steering,pred_throttle')
+
+
+def text_histogram(hist, width=40):
+    """
+    Error histogram as lines of '#', for the console.
+    """
+    counts, edges = np.asarray(hist['counts']), hist['edges']
+    top = max(counts.max(), 1)
+    return '\n'.join(
+        f"    {edges[i]:+.2f} {'#' * int(round(width * c / top))}"
+        for i, c in enumerate(counts) if c
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Batched offline evaluation of trained models")
+    parser.add_argument('data_datetime', nargs='+', help="session(s) under data/, e.g. 2022-02-22-22-22")
+    parser.add_argument('--models', nargs='+', default=['DonkeyNet-15epochs-0.001lr.pth'],
+                        help="model files in models/, any backend inference.py can load")
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--workers', type=int, default=2, help="data loading processes, 0 loads in the main process")
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help="CPU threads for inference")
+    parser.add_argument('--bins', type=int, default=40, help="error histogram bins over [-2, 2]")
+    parser.add_argument('--hist', action='store_true', help="print the error histograms")
+    args = parser.parse_args()
+    root = os.path.dirname(sys.path[0])
+    torch.set_num_threads(args.threads)
+    models = {}
+    for name in args.models:
+        model = inference.load_model(os.path.join(root, 'models', name), num_threads=args.threads)
+        if memory_format(model) == torch.channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        models[os.path.splitext(name)[0] + '-' + inference.guess_backend(name)] = model
+
+    for data_datetime in args.data_datetime:
+        data_dir = os.path.join(root, 'data', data_datetime)
+        dataset = datasets.load_session(data_dir, raw=True)
+        start_stamp = perf_counter()
+        predictions, labels = predict(dataset, models, args.batch_size, args.workers)
+        elapsed = perf_counter() - start_stamp
+        print(f"{data_datetime}: {len(dataset)} frames x {len(models)} models in {elapsed:.1f} s "
+              f"({len(dataset) * len(models) / elapsed:.0f} frames/s)")
+        eval_dir = os.path.join(data_dir, 'eval')
+        os.makedirs(eval_dir, exist_ok=True)
+        summary_path = os.path.join(eval_dir, 'summary.json')
+        summary = {}
+        if os.path.isfile(summary_path):  # keep the scores of models not evaluated this time
+            with open(summary_path) as f:
+                summary = json.load(f)
+        for name, pred in predictions.items():
+            save_predictions(os.path.join(eval_dir, name + '.csv'), pred, labels)
+            summary[name] = score(pred, labels, args.bins)
+            s = summary[name]
+            print(f"  {name}: mse {s['mse']:.4f} (steering {s['mse_steering']:.4f}, throttle {s['mse_throttle']:.4f}), "
+                  f"mae steering {s['mae_steering']:.4f}, throttle {s['mae_throttle']:.4f}")
+            if args.hist:
+                for axis in ('steering', 'throttle'):
+                    print(f"  {axis} error:\n{text_histogram(s['hist_' + axis])}")
+        recorders.write_json_atomic(summary_path, summary)
+        print(f"  predictions and summary saved to {eval_dir}")
@@ -0,0 +1,121 @@
+"""
+Freeze a trained model state_dict (.pth, any of convnets.MODELS) into a deployable artifact.
+torchscript: traced and frozen (weights folded into constants). The CPU
+             specific passes (conv+relu fusion, mkldnn layouts) can not be
+             serialized, inference.load_model() applies them at load time.
+onnx:        exported with constant folding, then pre-optimized by
+             onnxruntime (conv+relu fusion) if it is installed.
+After exporting, outputs are checked against the eager model and the
+latency of every backend is measured, all on frames of the camera size
+(hardware.FRAME_SIZE, 160 high x 120 wide) unless --height/--width say otherwise.
+e.g. python export_model.py ../models/DonkeyNet-15epochs-0.001lr.pth torchscript
+"""
+import os
+import sys
+import argparse
+from time import perf_counter
+import torch
+import inference
+from hardware import FRAME_SIZE
+
+INPUT_SHAPE = (1, 3, FRAME_SIZE[1], FRAME_SIZE[0])  # one camera frame
+
+
+def export_torchscript(model, out_path, input_shape=INPUT_SHAPE):
+    example = torch.rand(input_shape)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        frozen = torch.jit.freeze(traced)
+    frozen.save(out_path)
+
+
+def export_onnx(model, out_path, input_shape=INPUT_SHAPE):
+    """
+    Only the batch axis is dynamic, the file takes frames of input_shape.
+    """
+    example = torch.rand(input_shape)
+    torch.onnx.export(
+        model,
+        example,
+        out_path,
+        input_names=['image'],
+        output_names=['action'],
+        dynamic_axes={'image': {0: 'batch'}, 'action': {0: 'batch'}},
+        opset_version=13,
+        do_constant_folding=True,
+    )
+    if inference.ort is None:
+        print("onnxruntime not installed, skip graph optimization")
+        return
+    # Bake the portable (extended level) fusions into the file
+    options = inference.ort.SessionOptions()
+    options.graph_optimization_level = inference.ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    options.optimized_model_filepath = out_path
+    inference.ort.InferenceSession(out_path, options, providers=['CPUExecutionProvider'])
+
+
+def check_parity(reference, candidate, num_samples=20, atol=1e-4, input_shape=INPUT_SHAPE):
+    """
+    Largest absolute difference between two models over random inputs.
+    """
+    max_diff = 0.
+    with torch.inference_mode():
+        for _ in range(num_samples):
+            x = torch.rand(input_shape)
+            diff = (reference(x) - candidate(x)).abs().max().item()
+            max_diff = max(max_diff, diff)
+    return max_diff, max_diff <= atol
+
+
+def benchmark(model, num_iters=200, num_warmup=20, input_shape=INPUT_SHAPE):
+    """
+    Mean and p95 latency in millisecond of single frame inference.
+    """
+    x = torch.rand(input_shape)
+    times = []
+    with torch.inference_mode():
+        for i in range(num_warmup + num_iters):
+            t0 = perf_counter()
+            model(x)
+            if i >= num_warmup:
+                times.append(perf_counter() - t0)
+    times.sort()
+    return 1000 * sum(times) / len(times), 1000 * times[int(len(times) * .95)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export a trained model for fast CPU inference")
+    parser.add_argument('model_path', help="state_dict saved by train.py")
+    parser.add_argument('format', nargs='?', default='torchscript', choices=('torchscript', 'onnx'))
+    parser.add_argument('-o', '--output', help="output file, defaults to model_path with .pt/.onnx")
+    parser.add_argument('--atol', type=float, default=1e-4,
+                        help="largest absolute output error allowed against the eager model")
+    parser.add_argument('--height', type=int, default=INPUT_SHAPE[2], help="frame height the model is exported for")
+    parser.add_argument('--width', type=int, default=INPUT_SHAPE[3], help="frame width the model is exported for")
+    parser.add_argument('--threads', type=int, default=2, help="CPU threads for the benchmark")
+    args = parser.parse_args()
+    input_shape = (1, 3, args.height, args.width)
+
+    torch.set_num_threads(args.threads)
+    eager = inference.load_model(args.model_path, 'eager')
+    ext = '.pt' if args.format == 'torchscript' else '.onnx'
+    out_path = args.output or os.path.splitext(args.model_path)[0] + ext
+    if args.format == 'torchscript':
+        export_torchscript(eager, out_path, input_shape)
+    else:
+        export_onnx(eager, out_path, input_shape)
+    print(f"Exported {args.format} model to {out_path} ({os.path.getsize(out_path) / 1e6:.2f} MB)")
+
+    if args.format == 'onnx' and inference.ort is None:
+        print("parity: not checked, running the onnx model needs onnxruntime (see requirements.txt)")
+        sys.exit(0)
+    # Parity test
+    exported = inference.load_model(out_path, num_threads=args.threads)
+    max_diff, ok = check_parity(eager, exported, atol=args.atol, input_shape=input_shape)
+    print(f"parity: max abs error {max_diff:.2e}, tolerance {args.atol:.1e} -> {'PASS' if ok else 'FAIL'}")
+    # Latency benchmark
+    for name, model in (('eager', eager), (args.format, exported)):
+        mean_ms, p95_ms = benchmark(model, input_shape=input_shape)
+        print(f"{name:>12} latency on {input_shape}: mean {mean_ms:.2f} ms, p95 {p95_ms:.2f} ms")
+    if not ok:
+        sys.exit(f"parity check failed: max abs error {max_diff:.2e} > tolerance {args.atol:.1e}, raise it with --atol")
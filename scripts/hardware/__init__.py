@@ -0,0 +1,61 @@
+"""
+Camera, drivetrain, controller and headlight of the car, real or fake.
+Real devices import their libraries (picamera2, pyserial, pygame, gpiozero)
+only when created, so the fakes run on any Linux box: a replayed data/
+session for the camera, an in-memory sink for the serial output.
+"""
+import sys
+from .camera import FRAME_SIZE, Camera, PiCamera, FakeCamera, ReplayCamera
+from .drivetrain import Drivetrain, PicoDrivetrain, FakeDrivetrain, FakeSerial
+from .controller import Controller, JoystickController, FakeController
+from .light import Light, HeadLight, FakeLight
+from .duty import DutyEncoder
+
+
+class Rig:
+    """
+    The devices of one script, set up and torn down together.
+    Any of them may be None if the script does not use it.
+    """
+    def __init__(self, camera=None, drivetrain=None, controller=None, light=None):
+        self.camera = camera
+        self.drivetrain = drivetrain
+        self.controller = controller
+        self.light = light
+
+    def close(self):
+        """
+        Stop the car, then release every device. Safe to call more than once.
+        """
+        if self.drivetrain is not None:
+            self.drivetrain.stop()
+        for device in (self.light, self.camera, self.controller, self.drivetrain):
+            if device is None:
+                continue
+            try:
+                device.close()
+            except Exception as e:  # keep releasing the rest
+                print(f"Failed to close {type(device).__name__}: {e}", file=sys.stderr)
+        self.camera = self.drivetrain = self.controller = self.light = None
+
+
+def open_rig(params, camera=True, drivetrain=True, controller=True, light=True, replay=None, fps=20):
+    """
+    Real devices by default. With replay (a session directory) everything is
+    fake and the camera plays back that session at fps (0: as fast as possible).
+    """
+    rig = Rig()
+    try:
+        if light:
+            rig.light = FakeLight() if replay else HeadLight(params['led_pin'])
+        if drivetrain:
+            rig.drivetrain = FakeDrivetrain(params) if replay else PicoDrivetrain(params)
+        if controller:
+            rig.controller = FakeController() if replay else JoystickController()
+        if camera:
+            rig.camera = ReplayCamera(replay, fps=fps) if replay else PiCamera(fps=fps)
+            rig.camera.start()
+    except Exception:
+        rig.close()
+        raise
+    return rig
@@ -0,0 +1,171 @@
+"""
+Cameras. Every camera has start(), capture_array() -> frame (None when no
+frame comes), close() and frame_shape, known before the first capture.
+"""
+from time import perf_counter, sleep
+import numpy as np
+
+# Picamera2 size (width, height) every session was recorded with, frames are (160, 120, 3)
+FRAME_SIZE = (120, 160)
+
+
+class Camera:
+    frame_shape = None  # (height, width, channels)
+
+    def start(self):
+        pass
+
+    def capture_array(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def warm_up(self, num_frames=60, fps=20):
+        """
+        Let exposure settle, counting down the seconds. False if a frame is missing.
+        """
+        for i in reversed(range(num_frames)):
+            frame = self.capture_array()
+            if frame is None:
+                return False
+            if not i % fps:
+                print(i / fps)  # count down 3, 2, 1 sec
+        return True
+
+    def exposure_level(self):
+        """
+        Something that tracks auto exposure, here the mean brightness of a frame.
+        None if no frame comes.
+        """
+        frame = self.capture_array()
+        return None if frame is None else float(frame[::4, ::4].mean())
+
+    def settle(self, timeout=3., tolerance=.03, num_stable=4):
+        """
+        Capture until exposure stops changing: num_stable frames in a row within
+        tolerance (relative) of the previous one. Returns (settled, frames used),
+        settled is None if a frame is missing, False on timeout.
+        """
+        deadline = perf_counter() + timeout
+        last_level = None
+        stable = 0
+        num_frames = 0
+        while perf_counter() < deadline:
+            level = self.exposure_level()
+            if level is None:
+                return None, num_frames
+            num_frames += 1
+            if last_level is not None and abs(level - last_level) <= tolerance * max(last_level, 1e-6):
+                stable += 1
+                if stable == num_stable:
+                    return True, num_frames
+            else:
+                stable = 0
+            last_level = level
+        return False, num_frames
+
+
+class PiCamera(Camera):
+    """
+    Picamera2, RGB888 preview stream at a fixed frame rate (fps=None: sensor default).
+    """
+    def __init__(self, size=FRAME_SIZE, fps=20):
+        from picamera2 import Picamera2
+        self.frame_shape = (size[1], size[0], 3)  # size is width, height, as Picamera2 takes it
+        self.cam = Picamera2()
+        controls = {"FrameDurationLimits": (1000000 // fps, 1000000 // fps)} if fps else {}
+        self.cam.configure(
+            self.cam.create_preview_configuration(main={"format": 'RGB888', "size": size}, controls=controls)
+        )
+
+    def start(self):
+        self.cam.start()
+
+    def capture_array(self):
+        return self.cam.capture_array()
+
+    def exposure_level(self):
+        """
+        Exposure time x analogue gain of the next frame, what the AE algorithm adjusts.
+        """
+        request = self.cam.capture_request()
+        try:
+            metadata = request.get_metadata()
+        finally:
+            request.release()
+        return metadata.get('ExposureTime', 0) * metadata.get('AnalogueGain', 1.)
+
+    def close(self):
+        self.cam.stop()
+        self.cam.close()
+
+
+class _PacedCamera(Camera):
+    """
+    Hands out frames at fps like a sensor would, fps=0 for as fast as possible.
+    """
+    def __init__(self, fps=20):
+        self.period = 1. / fps if fps else 0.
+        self._next_stamp = None
+        self.count = 0
+
+    def start(self):
+        self._next_stamp = perf_counter()
+
+    def _wait(self):
+        if self._next_stamp is None:
+            self.start()
+        self._next_stamp += self.period
+        delay = self._next_stamp - perf_counter()
+        if delay > 0:
+            sleep(delay)
+        else:  # fell behind, the sensor does not wait for us
+            self._next_stamp = perf_counter()
+        self.count += 1
+
+
+class FakeCamera(_PacedCamera):
+    """
+    Random RGB888 frames, size is width, height like PiCamera.
+    """
+    def __init__(self, size=FRAME_SIZE, fps=20):
+        super().__init__(fps)
+        self.size = size
+        self.frame_shape = (size[1], size[0], 3)
+        rng = np.random.default_rng(0)
+        self._frames = rng.integers(0, 256, (8,) + self.frame_shape, dtype=np.uint8)
+
+    def capture_array(self):
+        self._wait()
+        return self._frames[self.count % len(self._frames)].copy()
+
+
+class ReplayCamera(_PacedCamera):
+    """
+    Frames of a recorded session under data/, in order. After the last frame
+    it starts over (loop=True) or returns None, which ends a control loop.
+    """
+    def __init__(self, session_dir, fps=20, loop=False):
+        import datasets  # pulls in torch, only needed for replays
+        super().__init__(fps)
+        self.session = datasets.load_session(session_dir, raw=True)
+        self.frame_shape = tuple(np.shape(self.session[0][0]))
+        self.loop = loop
+        self._idx = 0
+
+    def __len__(self):
+        return len(self.session)
+
+    def rewind(self):
+        self._idx = 0
+
+    def capture_array(self):
+        if self._idx == len(self.session):
+            if not self.loop:
+                return None
+            self._idx = 0
+        self._wait()
+        frame = self.session[self._idx][0]
+        self._idx += 1
+        return np.array(frame)  # a copy, like a real capture
@@ -0,0 +1,62 @@
+"""
+Gamepad. update() handles pending input and returns the buttons pressed since
+the last call, axis() reads the latest position of an axis.
+"""
+
+
+class Controller:
+    def update(self):
+        raise NotImplementedError
+
+    def axis(self, idx):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JoystickController(Controller):
+    """
+    First gamepad found by pygame.
+    """
+    def __init__(self, idx=0):
+        import pygame
+        self.pygame = pygame
+        pygame.display.init()
+        pygame.joystick.init()
+        self.js = pygame.joystick.Joystick(idx)
+
+    def update(self):
+        pressed = []
+        for e in self.pygame.event.get():
+            if e.type == self.pygame.JOYBUTTONDOWN:
+                pressed.append(e.button)
+        return pressed
+
+    def axis(self, idx):
+        return round(self.js.get_axis(idx), 2)  # keep 2 decimals
+
+    def close(self):
+        self.pygame.quit()
+
+
+class FakeController(Controller):
+    """
+    Scripted gamepad: set_axis() and press() stand in for the driver.
+    """
+    def __init__(self):
+        self.axes = {}
+        self._pressed = []
+
+    def set_axis(self, idx, value):
+        self.axes[idx] = value
+
+    def press(self, button):
+        self._pressed.append(button)
+
+    def update(self):
+        pressed, self._pressed = self._pressed, []
+        return pressed
+
+    def axis(self, idx):
+        return self.axes.get(idx, 0.)
@@ -0,0 +1,108 @@
+"""
+Drivetrain: steering servo and throttle ESC behind the Pico.
+send() never blocks, see transport.py. stop() centers steering and stalls throttle.
+"""
+from time import sleep
+import transport
+import protocol
+
+
+class Drivetrain:
+    def __init__(self, params):
+        self.neutral = (params['steering_center'], params['throttle_stall'])
+
+    def send(self, duty_st, duty_th, tag=None):
+        """
+        tag: the frame id, for telemetry
+        """
+        raise NotImplementedError
+
+    def stop(self):
+        self.send(*self.neutral)
+
+    def stats(self):
+        return {}
+
+    def attach(self, telemetry):
+        """
+        Record serial writes of tagged commands in telemetry.
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class PicoDrivetrain(Drivetrain):
+    """
+    Dutycycles to the Pico over USB serial, encoded with params['serial_protocol'].
+    """
+    def __init__(self, params, port='/dev/ttyACM0', ser=None):
+        super().__init__(params)
+        if ser is None:
+            import serial
+            ser = serial.Serial(port=port, baudrate=115200)
+        self.link = transport.SerialTransport(ser, protocol.make_encoder(params.get('serial_protocol', 'text')))
+
+    @property
+    def name(self):
+        return self.link.name
+
+    def send(self, duty_st, duty_th, tag=None):
+        self.link.send(duty_st, duty_th, tag)
+
+    def stats(self):
+        return self.link.stats()
+
+    def attach(self, telemetry):
+        self.link.telemetry = telemetry
+
+    def close(self):
+        self.link.close()
+
+
+class FakeSerial:
+    """
+    Stand-in for serial.Serial: an in-memory sink, optionally simulating write time.
+    """
+    def __init__(self, port='fake', write_delay=0.):
+        self.name = port
+        self.write_delay = write_delay
+        self.timeout = None
+        self.in_waiting = 0
+        self.bytes_written = 0
+        self.messages = 0
+        self.last_msg = None
+
+    def write(self, msg):
+        if self.write_delay:
+            sleep(self.write_delay)
+        self.bytes_written += len(msg)
+        self.messages += 1
+        self.last_msg = msg
+        return len(msg)
+
+    def read(self, size=1):
+        sleep(self.timeout or 0.)  # the fake Pico never answers
+        return b''
+
+    def close(self):
+        pass
+
+
+class FakeDrivetrain(PicoDrivetrain):
+    """
+    The real encoding and transport, writing into a FakeSerial.
+    """
+    def __init__(self, params, write_delay=0.):
+        self.ser = FakeSerial(write_delay=write_delay)
+        super().__init__(params, ser=self.ser)
+
+    def last_command(self):
+        """
+        The last (steering, throttle) written, decoded like the Pico does.
+        """
+        if self.ser.last_msg is None:
+            return None
+        commands, _ = protocol.decode_all(self.ser.last_msg)
+        return commands[-1] if commands else None
@@ -0,0 +1,66 @@
+"""
+Steering / throttle actions in [-1, 1] to servo and ESC dutycycles in nanosecond.
+Constants come from configs.json once, every action is quantized to
+resolution steps across [-1, 1] and looked up in a precomputed table.
+Optional per car calibration in configs.json, piecewise linear, applied to
+the action before the dutycycle formula, e.g.
+    "steering_calibration": [[-1, -0.9], [0, 0.04], [1, 1]]
+    "throttle_calibration": [[-1, -1], [0, 0], [0.1, 0.15], [1, 1]]
+"""
+import numpy as np
+
+
+class DutyEncoder:
+    def __init__(self, params, resolution=2001, max_action=1.):
+        self.resolution = resolution
+        self.max_action = max_action
+        self.scale = (resolution - 1) / 2
+        actions = np.linspace(-1., 1., resolution)
+        self.steering_table = self._steering(self._calibrate(actions, params.get('steering_calibration')), params)
+        self.throttle_table = self._throttle(self._calibrate(actions, params.get('throttle_calibration')), params)
+        # plain lists for scalar lookups, indexing numpy arrays one item at a time is slow
+        self._steering_list = self.steering_table.tolist()
+        self._throttle_list = self.throttle_table.tolist()
+
+    @staticmethod
+    def _calibrate(actions, curve):
+        if not curve:
+            return actions
+        xs, ys = zip(*curve)
+        return np.interp(actions, xs, ys)
+
+    @staticmethod
+    def _steering(st, params):
+        return (
+            params['steering_center'] - params['steering_range']
+            + np.trunc(params['steering_range'] * (st + 1)).astype(np.int64)
+        )
+
+    @staticmethod
+    def _throttle(th, params):
+        limit = params['throttle_limit']
+        fwd = np.trunc(params['throttle_fwd_range'] * np.minimum(th, limit))
+        rev = np.trunc(params['throttle_rev_range'] * np.maximum(th, -limit))
+        return params['throttle_stall'] + np.where(th > 0, fwd, np.where(th < 0, rev, 0)).astype(np.int64)
+
+    def encode(self, st, th):
+        """
+        Dutycycles (steering, throttle) of one action, as ints.
+        """
+        top = self.max_action  # clip and index inline, this runs every control step
+        st = top if st > top else -top if st < -top else st
+        th = top if th > top else -top if th < -top else th
+        return (
+            self._steering_list[int((st + 1.) * self.scale + .5)],
+            self._throttle_list[int((th + 1.) * self.scale + .5)],
+        )
+
+    def indices(self, actions):
+        actions = np.clip(np.asarray(actions, dtype=np.float64), -self.max_action, self.max_action)
+        return np.floor((actions + 1.) * self.scale + .5).astype(np.intp)
+
+    def encode_batch(self, st, th):
+        """
+        Dutycycles of whole arrays of actions, e.g. the labels of a session.
+        """
+        return self.steering_table[self.indices(st)], self.throttle_table[self.indices(th)]
@@ -0,0 +1,54 @@
+"""
+Headlight, shows the recording / autopilot state.
+"""
+
+
+class Light:
+    def on(self):
+        raise NotImplementedError
+
+    def off(self):
+        raise NotImplementedError
+
+    def toggle(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class HeadLight(Light):
+    """
+    LED on a GPIO pin.
+    """
+    def __init__(self, pin):
+        from gpiozero import LED
+        self.led = LED(pin)
+        self.led.off()
+
+    def on(self):
+        self.led.on()
+
+    def off(self):
+        self.led.off()
+
+    def toggle(self):
+        self.led.toggle()
+
+    def close(self):
+        self.led.off()
+        self.led.close()
+
+
+class FakeLight(Light):
+    def __init__(self):
+        self.is_lit = False
+
+    def on(self):
+        self.is_lit = True
+
+    def off(self):
+        self.is_lit = False
+
+    def toggle(self):
+        self.is_lit = not self.is_lit
@@ -0,0 +1,202 @@
+"""
+Inference runner for the autopilot.
+The input tensor is allocated once and every camera frame is converted
+into it in place, so the control loop does not allocate per frame.
+
+Models load through one of three backends:
+eager (state_dict .pth), torchscript (frozen .pt from export_model.py,
+or INT8 .pt from quantize.py)
+or onnx (.onnx, needs onnxruntime).
+"""
+import os
+import threading
+from time import perf_counter
+import numpy as np
+import torch
+try:
+    import onnxruntime as ort
+except ImportError:  # optional, only needed for the onnx backend
+    ort = None
+import convnets
+
+BACKENDS = ('eager', 'torchscript', 'onnx')
+EXTENSIONS = {'.pth': 'eager', '.pt': 'torchscript', '.onnx': 'onnx'}
+
+
+class OnnxModel:
+    """
+    Make an ONNX Runtime session look like a torch module.
+    """
+    def __init__(self, path, num_threads=2):
+        if ort is None:
+            raise RuntimeError("onnx backend needs onnxruntime: pip install onnxruntime")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def eval(self):
+        return self
+
+    def __call__(self, x):
+        pred = self.session.run(None, {self.input_name: x.numpy()})[0]
+        return torch.from_numpy(pred)
+
+
+def guess_backend(path):
+    ext = os.path.splitext(path)[1]
+    if ext not in EXTENSIONS:
+        raise ValueError(f"Can not tell the backend of {path}, expected one of {list(EXTENSIONS)}")
+    return EXTENSIONS[ext]
+
+
+def load_model(path, backend=None, num_threads=2, model_name=None):
+    """
+    Load a model file for CPU inference, backend is guessed from the extension if not given.
+    model_name: architecture in convnets.MODELS of an eager state_dict, guessed from the file name.
+    """
+    if backend is None:
+        backend = guess_backend(path)
+    if backend == 'eager':
+        model = convnets.make_model(model_name or convnets.guess_model_name(path))
+        model.load_state_dict(torch.load(path, map_location=torch.device('cpu')))
+    elif backend == 'torchscript':
+        extra_files = {'quant_engine': ''}  # set by quantize.py for INT8 models
+        model = torch.jit.load(path, map_location=torch.device('cpu'), _extra_files=extra_files)
+        model.eval()
+        quant_engine = extra_files['quant_engine']
+        if isinstance(quant_engine, bytes):
+            quant_engine = quant_engine.decode()
+        if quant_engine:
+            torch.backends.quantized.engine = quant_engine
+        else:
+            # Fuse conv+relu and pick CPU friendly layouts for this machine
+            model = torch.jit.optimize_for_inference(model)
+    elif backend == 'onnx':
+        model = OnnxModel(path, num_threads=num_threads)
+    else:
+        raise ValueError(f"Unknown backend: {backend}, choose from {BACKENDS}")
+    model.eval()
+    return model
+
+
+class InferenceRunner:
+    """
+    Wrap a model and feed it RGB888 frames from Picamera2.capture_array().
+    """
+    def __init__(self, model, frame_shape=None, num_threads=2, num_buffers=1):
+        self.model = model
+        self.model.eval()
+        torch.set_num_threads(num_threads)
+        # Use 3 buffers when preprocess and infer run on different threads.
+        # Each buffer has a lock, taken by preprocess and released by infer
+        # (or release() if the tensor is dropped), so a frame is never
+        # overwritten before the model has read it. preprocess takes the
+        # next buffer that is not locked and only waits if all of them are.
+        self.num_buffers = num_buffers
+        self._buffers = []
+        self._locks = {}  # data_ptr of a buffer -> its lock
+        self._next_buffer = 0
+        self._frame_shape = None
+        if frame_shape is not None:
+            self._allocate(frame_shape)
+        # Per-stage timings in seconds
+        self.num_frames = 0
+        self.last_timing = {'preprocess': 0., 'infer': 0.}
+        self.total_timing = {'preprocess': 0., 'infer': 0.}
+
+    def _allocate(self, frame_shape):
+        h, w, c = frame_shape
+        self._buffers = [
+            torch.empty(
+                (1, c, h, w),
+                dtype=torch.float32,
+                pin_memory=torch.cuda.is_available(),  # pinning needs a CUDA runtime
+            )
+            for _ in range(self.num_buffers)
+        ]
+        self._locks = {buf.data_ptr(): threading.Lock() for buf in self._buffers}
+        self._frame_shape = tuple(frame_shape)
+
+    def _acquire_buffer(self):
+        """
+        Next free buffer, locked. Skips the one the model is reading.
+        """
+        for k in range(self.num_buffers):
+            i = (self._next_buffer + k) % self.num_buffers
+            lock = self._locks[self._buffers[i].data_ptr()]
+            if lock.acquire(blocking=False):
+                break
+        else:  # every buffer is in use, wait for the one due next
+            i = self._next_buffer
+            lock = self._locks[self._buffers[i].data_ptr()]
+            lock.acquire()
+        self._next_buffer = (i + 1) % self.num_buffers
+        return self._buffers[i], lock
+
+    def warm_up(self, frame_shape, num_runs=3):
+        """
+        Allocate the buffers and run the model a few times on a blank frame:
+        the first calls are slow (TorchScript profiling, oneDNN primitive creation).
+        """
+        frame = np.zeros(frame_shape, dtype=np.uint8)
+        for _ in range(num_runs):
+            self.infer(self.preprocess(frame))
+        self.num_frames = 0
+        self.total_timing = {'preprocess': 0., 'infer': 0.}
+
+    def preprocess(self, frame):
+        """
+        uint8 HWC frame -> preallocated float32 NCHW tensor in [0, 1].
+        Same result as transforms.ToTensor(), without the temporaries.
+        """
+        t0 = perf_counter()
+        if self._frame_shape != frame.shape:
+            self._allocate(frame.shape)
+        img_tensor, lock = self._acquire_buffer()
+        try:
+            src = torch.from_numpy(frame).permute(2, 0, 1)  # a view, no copy
+            img_tensor[0].copy_(src)  # uint8 -> float32 in one pass
+            img_tensor.div_(255)
+        except BaseException:
+            lock.release()
+            raise
+        self._record('preprocess', perf_counter() - t0)
+        return img_tensor  # still locked, until infer() or release()
+
+    def release(self, img_tensor):
+        """
+        Unlock a buffer from preprocess() that will not go through infer(),
+        e.g. a frame dropped for a newer one. Other tensors are ignored.
+        """
+        lock = self._locks.get(img_tensor.data_ptr())
+        if lock is not None and lock.locked():
+            lock.release()
+
+    def infer(self, img_tensor):
+        t0 = perf_counter()
+        try:
+            with torch.inference_mode():
+                pred = self.model(img_tensor)
+        finally:
+            self.release(img_tensor)
+        pred_st, pred_th = pred[0].tolist()
+        self._record('infer', perf_counter() - t0)
+        self.num_frames += 1
+        return pred_st, pred_th
+
+    def __call__(self, frame):
+        return self.infer(self.preprocess(frame))
+
+    def _record(self, stage, seconds):
+        self.last_timing[stage] = seconds
+        self.total_timing[stage] += seconds
+
+    def timings(self):
+        """
+        Mean per-stage time in millisecond.
+        """
+        if not self.num_frames:
+            return {k: 0. for k in self.total_timing}
+        return {k: 1000 * v / self.num_frames for k, v in self.total_timing.items()}
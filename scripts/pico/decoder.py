@@ -0,0 +1,182 @@
+"""
+Upload this file to the pico board next to main.py.
+Decode dutycycle commands from the Raspberry Pi, byte by byte, without
+allocating (runs under MicroPython and CPython).
+Binary frame, 12 bytes, integers little endian:
+    0xA5 | version | seq | steering uint32 | throttle uint32 | crc8
+crc8 (poly 0x07) covers version to throttle.
+Text fallback: b"<steering>,<throttle>\n"
+main.py turns MicroPython's Ctrl-C off, frames carry 0x03 as data. A 0x03
+outside a binary frame is no command: an IDE (Thonny, mpremote) interrupting
+the program, it sets interrupted and main.py stops.
+Once a binary command is applied the Pico answers b"A<seq>\n", seq as 3 digits.
+Once a second it reports its health on the same link:
+    b"S<loop_hz>,<commands>,<gc_count>,<gc_us>,<mem_free>,<errors>\n"
+every field 7 digits, zero padded.
+"""
+SYNC = 0xA5
+CTRL_C = 0x03
+VERSION = 1
+FRAME_SIZE = 12
+RING_SIZE = 64  # power of two, serial input is read into a ring of this size
+STATUS_FIELDS = ('loop_hz', 'commands', 'gc_count', 'gc_us', 'mem_free', 'errors')
+STATUS_WIDTH = 7
+
+# CRC-8, polynomial 0x07
+CRC8_TABLE = bytearray(256)
+for _i in range(256):
+    _crc = _i
+    for _ in range(8):
+        _crc = ((_crc << 1) ^ 0x07) & 0xFF if _crc & 0x80 else (_crc << 1) & 0xFF
+    CRC8_TABLE[_i] = _crc
+
+
+def crc8(data, start=0, end=None):
+    crc = 0
+    if end is None:
+        end = len(data)
+    for i in range(start, end):
+        crc = CRC8_TABLE[crc ^ data[i]]
+    return crc
+
+
+class CommandDecoder:
+    """
+    Feed bytes in, read steering/throttle (nanosecond) out when feed() returns True.
+    """
+    # parser states
+    IDLE = 0
+    BINARY = 1
+    TEXT_ST = 2
+    TEXT_TH = 3
+    SKIP = 4  # garbled text, wait for the end of the line
+
+    def __init__(self):
+        self.frame = bytearray(FRAME_SIZE)
+        self.ack = bytearray(b'A000\n')
+        self.state = self.IDLE
+        self.pos = 0
+        self.steering = 0
+        self.throttle = 0
+        self.seq = -1
+        self._st = 0
+        self._th = 0
+        self.num_binary = 0
+        self.num_text = 0
+        self.num_errors = 0  # bad crc, unknown version or garbled text
+        self.interrupted = False  # Ctrl-C seen outside a binary frame
+
+    def feed(self, byte):
+        state = self.state
+        if state == self.BINARY:
+            self.frame[self.pos] = byte
+            self.pos += 1
+            if self.pos == FRAME_SIZE:
+                self.state = self.IDLE
+                return self._finish_binary()
+            return False
+        if byte == SYNC:  # a new binary frame, also aborts a partial text line
+            if state != self.IDLE:
+                self.num_errors += 1
+            self.frame[0] = byte
+            self.pos = 1
+            self.state = self.BINARY
+            return False
+        if byte == CTRL_C:
+            self.interrupted = True
+            self.state = self.IDLE
+            return False
+        if state == self.SKIP:
+            if byte == 10 or byte == 13:
+                self.state = self.IDLE
+            return False
+        if 48 <= byte <= 57:  # digit
+            if state == self.TEXT_TH:
+                self._th = self._th * 10 + byte - 48
+            elif state == self.TEXT_ST:
+                self._st = self._st * 10 + byte - 48
+            else:
+                self._st = byte - 48
+                self.state = self.TEXT_ST
+            return False
+        if byte == 44 and state == self.TEXT_ST:  # ','
+            self._th = 0
+            self.state = self.TEXT_TH
+            return False
+        if byte == 10 or byte == 13:  # '\n' or '\r'
+            if state == self.TEXT_TH:
+                self.steering = self._st
+                self.throttle = self._th
+                self.seq = -1  # text commands are not acked
+                self.num_text += 1
+                self.state = self.IDLE
+                return True
+            if state != self.IDLE:
+                self.num_errors += 1
+            self.state = self.IDLE
+            return False
+        self.num_errors += 1  # anything else breaks the line
+        self.state = self.SKIP
+        return False
+
+    def _finish_binary(self):
+        frame = self.frame
+        if frame[1] != VERSION or crc8(frame, 1, FRAME_SIZE - 1) != frame[FRAME_SIZE - 1]:
+            self.num_errors += 1
+            # The frame may have been cut short, resync on the next sync byte in it
+            for k in range(1, FRAME_SIZE):
+                if frame[k] == SYNC:
+                    for j in range(FRAME_SIZE - k):
+                        frame[j] = frame[j + k]
+                    self.pos = FRAME_SIZE - k
+                    self.state = self.BINARY
+                    break
+            return False
+        self.seq = frame[2]
+        self.steering = frame[3] | (frame[4] << 8) | (frame[5] << 16) | (frame[6] << 24)
+        self.throttle = frame[7] | (frame[8] << 8) | (frame[9] << 16) | (frame[10] << 24)
+        self.num_binary += 1
+        return True
+
+    def feed_ring(self, ring, tail, head):
+        """
+        Feed ring[tail:head], wrapping around, and return the number of complete commands.
+        The latest one is left in steering/throttle.
+        """
+        mask = len(ring) - 1
+        count = 0
+        while tail != head:
+            if self.feed(ring[tail]):
+                count += 1
+            tail = (tail + 1) & mask
+        return count
+
+    def make_ack(self):
+        """
+        Fill the ack line for the last binary frame in place and return it.
+        """
+        seq = self.seq
+        self.ack[3] = 48 + seq % 10
+        self.ack[2] = 48 + seq // 10 % 10
+        self.ack[1] = 48 + seq // 100
+        return self.ack
+
+
+class StatusLine:
+    """
+    Preallocated health report, fields are filled in place.
+    """
+    def __init__(self):
+        self.line = bytearray(b'S' + b','.join([b'0' * STATUS_WIDTH] * len(STATUS_FIELDS)) + b'\n')
+        self.top = 10 ** STATUS_WIDTH - 1
+
+    def set(self, field, value):
+        """
+        Write a non negative integer into field (index in STATUS_FIELDS), saturating.
+        """
+        if value > self.top:
+            value = self.top
+        end = 1 + field * (STATUS_WIDTH + 1) + STATUS_WIDTH
+        for i in range(end - 1, end - 1 - STATUS_WIDTH, -1):
+            self.line[i] = 48 + value % 10
+            value //= 10
@@ -1,31 +1,113 @@
 """
-Upload this script to the pico board, then rename it to main.py.
-Read dutycycle in nanoseconds via USB BUS.
+Upload this script and decoder.py to the pico board, then rename this one to main.py.
+Read dutycycle in nanoseconds via USB BUS, binary frames or text lines.
+Binary commands are acked once applied. Without a fresh command for
+FAILSAFE_MS, steering centers and throttle stalls.
+The loop does not allocate: serial input is read into a preallocated ring,
+parsed in place, and the garbage collector only runs right after the
+status report, which goes out once every STATUS_MS.
 """
 import sys
+import gc
 import select
-from time import sleep
+import micropython
+from time import sleep, ticks_ms, ticks_us, ticks_diff
 from machine import Pin, PWM
+from decoder import CommandDecoder, StatusLine, RING_SIZE
 
 # SETUP
+STEERING_CENTER = 1500000  # keep in line with configs.json
+THROTTLE_STALL = 1210000
+FAILSAFE_MS = 250
+POLL_MS = FAILSAFE_MS // 5
+STATUS_MS = 1000
 steering = PWM(Pin(0))
 steering.freq(50)
 throttle = PWM(Pin(15))
 throttle.freq(50)
 sleep(3)  # ESC calibrate
+# Binary frames carry any byte value, 0x03 must not raise KeyboardInterrupt (Ctrl-C).
+# The decoder still tells an IDE's Ctrl-C between frames apart, see the loop
+micropython.kbd_intr(-1)
 poller = select.poll()
 poller.register(sys.stdin, select.POLLIN)
-event = poller.poll()
+stdin = sys.stdin.buffer
+stdout = sys.stdout.buffer
+ring = bytearray(RING_SIZE)
+ring_view = memoryview(ring)
+slots = [ring_view[i:i + 1] for i in range(RING_SIZE)]  # readinto these, no slicing in the loop
+ring_mask = RING_SIZE - 1
+head = 0
+tail = 0
+decoder = CommandDecoder()
+status = StatusLine()
+duty_st = -1  # last applied dutycycles
+duty_th = -1
+last_command = ticks_ms()
+last_status = last_command
+is_failsafe = False
+num_loops = 0
+num_commands = 0
+num_gc = 0
+gc_us = 0
+gc.disable()
+gc.collect()
+
+
+def readable(timeout):
+    for _ in poller.ipoll(timeout):  # ipoll does not allocate, poll does
+        return True
+    return False
+
+
+def apply(st, th):
+    global duty_st, duty_th
+    if st != duty_st:
+        steering.duty_ns(st)
+        duty_st = st
+    if th != duty_th:
+        throttle.duty_ns(th)
+        duty_th = th
+
 
 # LOOP
 while True:
-    # read data from serial
-    for msg, _ in event:
-        buffer = msg.readline().rstrip().split(',')
-        # print(buffer) # debug
-        # print(len(buffer)) # debug
-        if len(buffer) == 2:
-            ns_st, ns_th = int(buffer[0]), int(buffer[1])
-            print(ns_st, ns_th) # debug
-            steering.duty_ns(ns_st)
-            throttle.duty_ns(ns_th)
+    num_loops += 1
+    # read everything waiting on serial into the ring
+    if readable(POLL_MS):
+        while (head + 1) & ring_mask != tail and readable(0):
+            stdin.readinto(slots[head])
+            head = (head + 1) & ring_mask
+        num_new = decoder.feed_ring(ring, tail, head)
+        tail = head
+        if decoder.interrupted:  # Ctrl-C from Thonny or mpremote: stop the car, give the REPL back
+            apply(STEERING_CENTER, THROTTLE_STALL)
+            micropython.kbd_intr(3)
+            raise KeyboardInterrupt
+        if num_new:  # only the latest command matters
+            apply(decoder.steering, decoder.throttle)
+            # print(decoder.steering, decoder.throttle) # debug, floods the USB link
+            num_commands += num_new
+            last_command = ticks_ms()
+            is_failsafe = False
+            if decoder.seq >= 0:
+                stdout.write(decoder.make_ack())
+    now = ticks_ms()
+    if not is_failsafe and ticks_diff(now, last_command) > FAILSAFE_MS:
+        apply(STEERING_CENTER, THROTTLE_STALL)
+        is_failsafe = True
+    elapsed = ticks_diff(now, last_status)
+    if elapsed >= STATUS_MS:
+        status.set(0, num_loops * 1000 // elapsed)
+        status.set(1, num_commands)
+        status.set(2, num_gc)
+        status.set(3, gc_us)
+        status.set(4, gc.mem_free())
+        status.set(5, decoder.num_errors)
+        stdout.write(status.line)
+        num_loops = 0
+        last_status = now
+        gc_start = ticks_us()
+        gc.collect()  # little to collect, the loop does not allocate
+        gc_us = ticks_diff(ticks_us(), gc_start)
+        num_gc += 1
@@ -0,0 +1,262 @@
+"""
+Staged capture -> preprocess -> infer -> actuate engine for the autopilot.
+Every stage runs on its own thread. Neighbouring stages are joined by
+single-slot "latest wins" queues: a slow consumer never builds a backlog,
+it just picks up the newest item and the stale ones are counted as dropped.
+
+Run this file directly to benchmark the serial loop against the pipeline
+with a fake camera and a fake serial port (see hardware/), e.g.
+python pipeline.py 10  # seconds per run
+"""
+import sys
+import threading
+from time import perf_counter, sleep
+
+
+class LatestSlot:
+    """
+    Single-slot mailbox. put() never blocks and overwrites an unread item,
+    handing it to on_drop if given.
+    """
+    def __init__(self, on_drop=None):
+        self._cond = threading.Condition()
+        self._item = None
+        self._fresh = False
+        self._closed = False
+        self.on_drop = on_drop
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._fresh:
+                self.dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop(self._item)
+            self._item = item
+            self._fresh = True
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        Block until an unread item arrives. Return None on timeout or close.
+        """
+        with self._cond:
+            if not self._fresh and not self._closed:
+                self._cond.wait_for(lambda: self._fresh or self._closed, timeout)
+            if not self._fresh:
+                return None
+            self._fresh = False
+            item = self._item
+            self._item = None
+            return item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class Packet:
+    """
+    Unit of work handed between stages.
+    """
+    __slots__ = ('frame_id', 't_capture', 'data')
+
+    def __init__(self, frame_id, t_capture, data):
+        self.frame_id = frame_id
+        self.t_capture = t_capture
+        self.data = data
+
+
+class ControlPipeline:
+    """
+    capture_fn() -> frame (None to stop)
+    preprocess_fn(frame) -> model input
+    infer_fn(model input) -> (steer, throttle)
+    actuate_fn((steer, throttle)) -> None
+    release_fn(model input) -> None, if given, gets every model input that
+    infer_fn never sees (dropped for a newer one, or unread at stop), e.g.
+    InferenceRunner.release to unlock its buffer.
+    Stage timings also go to telemetry (see telemetry.py) if given. A stage
+    function can read the id of the frame it is working on from frame_ids.
+    """
+    STAGES = ('capture', 'preprocess', 'infer', 'actuate')
+
+    def __init__(self, capture_fn, preprocess_fn, infer_fn, actuate_fn, telemetry=None, release_fn=None):
+        self._fns = {
+            'preprocess': preprocess_fn,
+            'infer': infer_fn,
+            'actuate': actuate_fn,
+        }
+        self._capture_fn = capture_fn
+        self.telemetry = telemetry
+        self.frame_ids = dict.fromkeys(self.STAGES)
+        self._slots = {name: LatestSlot() for name in self.STAGES[1:]}
+        self._release_fn = release_fn
+        if release_fn is not None:
+            self._slots['infer'].on_drop = lambda pkt: release_fn(pkt.data)
+        self._threads = []
+        self._stop = threading.Event()
+        self.error = None
+        self.counts = dict.fromkeys(self.STAGES, 0)
+        self.busy_time = dict.fromkeys(self.STAGES, 0.)
+        self.latencies = []  # capture -> actuate, seconds
+        self.max_latencies = 1000  # keep the latest ones only
+        self._start_stamp = None
+
+    def start(self):
+        self._start_stamp = perf_counter()
+        self._threads = [threading.Thread(target=self._capture_loop, name='capture', daemon=True)]
+        for i, name in enumerate(self.STAGES[1:], start=1):
+            out_slot = self._slots[self.STAGES[i + 1]] if i + 1 < len(self.STAGES) else None
+            self._threads.append(
+                threading.Thread(
+                    target=self._stage_loop,
+                    args=(name, self._slots[name], out_slot),
+                    name=name,
+                    daemon=True,
+                )
+            )
+        for t in self._threads:
+            t.start()
+
+    def stop(self, timeout=1.):
+        self._stop.set()
+        for slot in self._slots.values():
+            slot.close()
+        for t in self._threads:
+            if t is not threading.current_thread():
+                t.join(timeout)
+        pkt = self._slots['infer'].get(timeout=0)  # preprocessed, never inferred
+        if pkt is not None and self._release_fn is not None:
+            self._release_fn(pkt.data)
+
+    def is_running(self):
+        return not self._stop.is_set()
+
+    def _fail(self, err):
+        if self.error is None:
+            self.error = err
+        self._stop.set()
+        for slot in self._slots.values():
+            slot.close()
+
+    def _capture_loop(self):
+        out_slot = self._slots['preprocess']
+        frame_id = 0
+        try:
+            while not self._stop.is_set():
+                t0 = perf_counter()
+                frame = self._capture_fn()
+                t1 = perf_counter()
+                if frame is None:
+                    self._fail(RuntimeError("No frame received"))
+                    return
+                self.busy_time['capture'] += t1 - t0
+                self.counts['capture'] += 1
+                if self.telemetry is not None:
+                    self.telemetry.record(frame_id, 'capture', t0, t1)
+                out_slot.put(Packet(frame_id, t1, frame))
+                frame_id += 1
+        except Exception as e:
+            self._fail(e)
+
+    def _stage_loop(self, name, in_slot, out_slot):
+        fn = self._fns[name]
+        try:
+            while not self._stop.is_set():
+                pkt = in_slot.get(timeout=.1)
+                if pkt is None:
+                    continue
+                self.frame_ids[name] = pkt.frame_id
+                t0 = perf_counter()
+                result = fn(pkt.data)
+                t1 = perf_counter()
+                self.busy_time[name] += t1 - t0
+                self.counts[name] += 1
+                if self.telemetry is not None:
+                    self.telemetry.record(pkt.frame_id, name, t0, t1)
+                if out_slot is not None:
+                    pkt.data = result
+                    out_slot.put(pkt)
+                else:
+                    self.latencies.append(t1 - pkt.t_capture)
+                    if len(self.latencies) > self.max_latencies:
+                        del self.latencies[:-self.max_latencies]
+        except Exception as e:
+            self._fail(e)
+
+    def stats(self):
+        """
+        Snapshot of rates (Hz), mean stage busy time (ms), drops and latency (ms).
+        """
+        elapsed = perf_counter() - self._start_stamp if self._start_stamp else 0.
+        lat = sorted(self.latencies)
+        summary = {
+            'elapsed': elapsed,
+            'control_rate': self.counts['actuate'] / elapsed if elapsed else 0.,
+            'capture_rate': self.counts['capture'] / elapsed if elapsed else 0.,
+            'dropped': {name: slot.dropped for name, slot in self._slots.items()},
+            'stage_ms': {
+                name: 1000 * self.busy_time[name] / self.counts[name]
+                for name in self.STAGES if self.counts[name]
+            },
+        }
+        if lat:
+            summary['latency_ms'] = {
+                'mean': 1000 * sum(lat) / len(lat),
+                'p50': 1000 * lat[len(lat) // 2],
+                'p95': 1000 * lat[min(len(lat) - 1, int(len(lat) * .95))],
+                'max': 1000 * lat[-1],
+            }
+        return summary
+
+
+# BENCHMARK
+if __name__ == '__main__':
+    import os
+    import json
+    import convnets
+    from inference import InferenceRunner
+    from hardware import FakeCamera, FakeSerial, DutyEncoder
+
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.
+    params = json.load(open(os.path.join(sys.path[0], 'configs.json')))
+    runner = InferenceRunner(convnets.DonkeyNet(), num_buffers=3)
+    duty = DutyEncoder(params, max_action=.999)
+    preprocess, infer = runner.preprocess, runner.infer
+
+    for fps in (20, 0):  # camera paced like the real one, then unthrottled
+        ser = FakeSerial()
+
+        def actuate(action):
+            duty_st, duty_th = duty.encode(*action)
+            ser.write((str(duty_st) + "," + str(duty_th) + "\n").encode('utf-8'))
+
+        # Serial loop, as autopilot.py used to do it
+        cam = FakeCamera(fps=fps)
+        latencies = []
+        count = 0
+        start_stamp = perf_counter()
+        while perf_counter() - start_stamp < duration:
+            frame = cam.capture_array()
+            t_capture = perf_counter()
+            actuate(infer(preprocess(frame)))
+            latencies.append(perf_counter() - t_capture)
+            count += 1
+        latencies.sort()
+        print(f"camera fps: {fps or 'unlimited'}")
+        print(f"  serial   control rate: {count / duration:.1f} Hz, "
+              f"latency p50: {1000 * latencies[len(latencies) // 2]:.1f} ms, "
+              f"max: {1000 * latencies[-1]:.1f} ms")
+        # Pipelined loop
+        cam = FakeCamera(fps=fps)
+        pipe = ControlPipeline(cam.capture_array, preprocess, infer, actuate, release_fn=runner.release)
+        pipe.start()
+        sleep(duration)
+        pipe.stop()
+        stats = pipe.stats()
+        lat = stats.get('latency_ms', {})
+        print(f"  pipeline control rate: {stats['control_rate']:.1f} Hz, "
+              f"latency p50: {lat.get('p50', 0):.1f} ms, max: {lat.get('max', 0):.1f} ms, "
+              f"dropped: {stats['dropped']}")
@@ -0,0 +1,120 @@
+"""
+Compare the architectures in convnets.MODELS: parameters, FLOPs of one
+frame and measured CPU latency, against a per frame time budget.
+With --summary (written by evaluate.py) the test MSE of trained models is
+added and the most accurate architecture within the budget is recommended.
+e.g. python profile_models.py --budget-ms 50 --threads 2
+e.g. python profile_models.py --summary ../data/2022-02-22-22-22/eval/summary.json
+"""
+import json
+import argparse
+from time import perf_counter
+import numpy as np
+import torch
+import torch.nn as nn
+import convnets
+from hardware import FRAME_SIZE
+
+
+def count_flops(model, input_shape):
+    """
+    Multiply-adds of convolutions and linear layers for one input, times 2.
+    """
+    macs = []
+
+    def conv_hook(module, inputs, output):
+        kh, kw = module.kernel_size
+        macs.append(output.numel() * (module.in_channels // module.groups) * kh * kw)
+
+    def linear_hook(module, inputs, output):
+        macs.append(output.numel() * module.in_features)
+
+    handles = []
+    for module in model.modules():
+        if isinstance(module, nn.Conv2d):
+            handles.append(module.register_forward_hook(conv_hook))
+        elif isinstance(module, nn.Linear):
+            handles.append(module.register_forward_hook(linear_hook))
+    with torch.inference_mode():
+        model(torch.rand(1, *input_shape))
+    for handle in handles:
+        handle.remove()
+    return 2 * sum(macs)
+
+
+def measure_latency(model, input_shape, num_runs=100, num_warmup=10):
+    """
+    Median and p95 milliseconds of single frame inference.
+    """
+    x = torch.rand(1, *input_shape)
+    times = []
+    with torch.inference_mode():
+        for i in range(num_warmup + num_runs):
+            t0 = perf_counter()
+            model(x)
+            if i >= num_warmup:
+                times.append(perf_counter() - t0)
+    return 1000 * float(np.median(times)), 1000 * float(np.percentile(times, 95))
+
+
+def freeze(model, input_shape):
+    """
+    Traced, frozen and optimized, as export_model.py and inference.load_model() deploy it.
+    """
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, torch.rand(1, *input_shape))
+    return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+
+def best_mse(summary, name):
+    """
+    Lowest MSE among the evaluated models of an architecture, None if there are none.
+    """
+    scores = [s['mse'] for model, s in summary.items() if model.split('-')[0] == name]
+    return min(scores) if scores else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="FLOPs, parameters and CPU latency of the model zoo")
+    parser.add_argument('--models', nargs='+', default=list(convnets.MODELS), choices=list(convnets.MODELS))
+    parser.add_argument('--height', type=int, default=FRAME_SIZE[1], help="default: the camera frames")
+    parser.add_argument('--width', type=int, default=FRAME_SIZE[0])
+    parser.add_argument('--threads', type=int, default=2, help="CPU threads, as the autopilot uses")
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--budget-ms', type=float, default=50., help="time budget per frame (20 FPS camera)")
+    parser.add_argument('--eager', action='store_true', help="time the eager model instead of the frozen one")
+    parser.add_argument('--summary', help="summary.json from evaluate.py, adds test MSE and a recommendation")
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+    input_shape = (3, args.height, args.width)
+    summary = {}
+    if args.summary:
+        with open(args.summary) as f:
+            summary = json.load(f)
+
+    rows = []
+    print(f"input {input_shape}, {args.threads} threads, {'eager' if args.eager else 'frozen torchscript'}, "
+          f"budget {args.budget_ms:.0f} ms")
+    print(f"{'model':>16} {'params':>10} {'MFLOPs':>9} {'p50 ms':>8} {'p95 ms':>8} {'fits':>5} {'mse':>8}")
+    for name in args.models:
+        model = convnets.make_model(name).eval()
+        try:
+            flops = count_flops(model, input_shape)
+        except RuntimeError as e:  # DonkeyNet only takes 160x120 and 120x160
+            print(f"{name:>16} does not take {input_shape}: {str(e).splitlines()[0]}")
+            continue
+        num_params = sum(p.numel() for p in model.parameters())
+        timed = model if args.eager else freeze(model, input_shape)
+        p50, p95 = measure_latency(timed, input_shape, args.runs)
+        mse = best_mse(summary, name)
+        fits = p95 <= args.budget_ms
+        rows.append((name, mse, fits))
+        print(f"{name:>16} {num_params:>10,d} {flops / 1e6:>9.1f} {p50:>8.2f} {p95:>8.2f} {'yes' if fits else 'no':>5} "
+              f"{'-' if mse is None else f'{mse:.4f}':>8}")
+    if args.summary:
+        candidates = [(mse, name) for name, mse, fits in rows if fits and mse is not None]
+        if candidates:
+            mse, name = min(candidates)
+            print(f"Most accurate within {args.budget_ms:.0f} ms (p95): {name}, test mse {mse:.4f}")
+        else:
+            print(f"No evaluated model fits {args.budget_ms:.0f} ms")
@@ -0,0 +1,76 @@
+"""
+Encode dutycycle commands for the Pico, see pico/decoder.py for the format.
+binary: 12 byte frame with sequence number and CRC, corrupted or partial
+        frames are detected and dropped by the Pico.
+text:   the original b"<steering>,<throttle>\\n", kept as a fallback.
+Pick one with "serial_protocol" in configs.json.
+The Pico acks every binary command with b"A<seq>\n", see parse_ack(), and
+reports its loop rate and GC activity once a second, see parse_status().
+"""
+import os
+import sys
+import struct
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pico'))
+from decoder import SYNC, VERSION, FRAME_SIZE, RING_SIZE, STATUS_FIELDS, STATUS_WIDTH, crc8, CommandDecoder, StatusLine
+
+PROTOCOLS = ('binary', 'text')
+_FRAME = struct.Struct('<BBBII')  # everything but the trailing crc
+
+
+class BinaryEncoder:
+    def __init__(self):
+        self.seq = 0
+        self._frame = bytearray(FRAME_SIZE)
+
+    def encode(self, duty_st, duty_th):
+        _FRAME.pack_into(self._frame, 0, SYNC, VERSION, self.seq, duty_st, duty_th)
+        self._frame[FRAME_SIZE - 1] = crc8(self._frame, 1, FRAME_SIZE - 1)
+        self.seq = (self.seq + 1) & 0xFF
+        return bytes(self._frame)
+
+
+class TextEncoder:
+    def encode(self, duty_st, duty_th):
+        return (str(duty_st) + "," + str(duty_th) + "\n").encode('utf-8')
+
+
+def make_encoder(protocol='binary'):
+    if protocol == 'binary':
+        return BinaryEncoder()
+    if protocol == 'text':
+        return TextEncoder()
+    raise ValueError(f"Unknown serial protocol: {protocol}, choose from {PROTOCOLS}")
+
+
+def parse_ack(line):
+    """
+    Sequence number of an ack line from the Pico, None for any other line.
+    """
+    line = line.strip()
+    if len(line) == 4 and line[:1] == b'A' and line[1:].isdigit():
+        return int(line[1:])
+    return None
+
+
+def parse_status(line):
+    """
+    Dict of a status line from the Pico, None for any other line.
+    """
+    line = line.strip()
+    fields = line[1:].split(b',')
+    if line[:1] != b'S' or len(fields) != len(STATUS_FIELDS) or not all(f.isdigit() for f in fields):
+        return None
+    return dict(zip(STATUS_FIELDS, map(int, fields)))
+
+
+def decode_all(data):
+    """
+    Decode a byte string with the Pico's decoder, for host-side checks.
+    """
+    decoder = CommandDecoder()
+    commands = []
+    for byte in data:
+        if decoder.feed(byte):
+            commands.append((decoder.steering, decoder.throttle))
+    return commands, decoder
@@ -0,0 +1,107 @@
+"""
+Post-training static INT8 quantization of a DonkeyNet trained by train.py.
+Calibrates on frames from the session the model was trained on, then
+reports test MSE, latency and model size against the FP32 model.
+The quantized model is saved as TorchScript next to the .pth, copy it to
+models/ and drive with python autopilot.py <name>-int8.pt
+Only DonkeyNet has a quantizable version, pass the --seed it was trained
+with so the test frames are the ones held out in training, e.g.
+python quantize.py 2022-02-22-22-22 DonkeyNet-15epochs-0.001lr.pth --seed 0
+"""
+import io
+import os
+import sys
+import argparse
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Subset
+from torch.ao.quantization import get_default_qconfig, prepare, convert
+import convnets
+import datasets
+from export_model import benchmark
+
+
+def evaluate(model, dataloader, loss_fn):
+    ep_loss = 0.
+    with torch.inference_mode():
+        for b, (im, st, th) in enumerate(dataloader):
+            target = torch.stack((st, th), dim=-1)
+            batch_loss = loss_fn(model(im), target)
+            ep_loss = (ep_loss * b + batch_loss.item()) / (b + 1)
+    return ep_loss
+
+
+def serialized_size(model):
+    buffer = io.BytesIO()
+    torch.jit.save(torch.jit.script(model), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def quantize(state_dict, calib_dataloader, engine):
+    torch.backends.quantized.engine = engine
+    model = convnets.QuantDonkeyNet()
+    model.load_state_dict(state_dict)
+    model.eval()
+    model.fuse()
+    model.qconfig = get_default_qconfig(engine)
+    prepare(model, inplace=True)
+    with torch.inference_mode():  # calibrate activation observers
+        for im, _, _ in calib_dataloader:
+            model(im)
+    convert(model, inplace=True)
+    return model
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Quantize DonkeyNet to INT8")
+    parser.add_argument('data_datetime', help="session under data/, e.g. 2022-02-22-22-22")
+    parser.add_argument('model_name', help="state_dict in the session directory")
+    parser.add_argument('--engine', default='qnnpack', choices=('qnnpack', 'fbgemm'),
+                        help="qnnpack for ARM (Raspberry Pi), fbgemm for x86")
+    parser.add_argument('--num-calib', type=int, default=500, help="calibration frames")
+    parser.add_argument('--threads', type=int, default=2, help="CPU threads for the benchmark")
+    parser.add_argument('--seed', type=int, default=0, help="the --seed the model was trained with")
+    args = parser.parse_args()
+    architecture = convnets.guess_model_name(args.model_name)
+    if architecture != 'DonkeyNet':
+        parser.error(f"{args.model_name} is a {architecture}, only DonkeyNet has a quantizable version (QuantDonkeyNet)")
+    if args.engine not in torch.backends.quantized.supported_engines:
+        print(f"Quantized engine {args.engine} is not supported on this machine")
+        sys.exit(1)
+    torch.set_num_threads(args.threads)
+
+    # The split of train.py, calibrate on training frames and test on the held-out ones
+    data_dir = os.path.join(os.path.dirname(sys.path[0]), 'data', args.data_datetime)
+    train_data, test_data = datasets.split_dataset(datasets.load_session(data_dir), .1, args.seed)
+    calib_idx = torch.randperm(len(train_data), generator=torch.Generator().manual_seed(1))[:args.num_calib]
+    calib_dataloader = DataLoader(Subset(train_data, calib_idx.tolist()), batch_size=125)
+    test_dataloader = DataLoader(test_data, batch_size=125)
+    print(f"calibration size: {len(calib_idx)}, test size: {len(test_data)}")
+
+    model_path = os.path.join(data_dir, args.model_name)
+    state_dict = torch.load(model_path, map_location=torch.device('cpu'))
+    fp32_model = convnets.DonkeyNet()
+    try:
+        fp32_model.load_state_dict(state_dict)
+    except RuntimeError as e:  # a file name without the architecture prefix
+        parser.error(f"{args.model_name} is not a DonkeyNet state_dict: {str(e).splitlines()[0]}")
+    fp32_model.eval()
+    int8_model = quantize(state_dict, calib_dataloader, args.engine)
+
+    # Report
+    loss_fn = nn.MSELoss()
+    report = {}
+    for name, model in (('fp32', fp32_model), ('int8', int8_model)):
+        report[name] = {
+            'mse': evaluate(model, test_dataloader, loss_fn),
+            'latency_ms': benchmark(model)[0],
+            'size_mb': serialized_size(model) / 1e6,
+        }
+    for key in ('mse', 'latency_ms', 'size_mb'):
+        fp32_val, int8_val = report['fp32'][key], report['int8'][key]
+        print(f"{key:>10}: fp32 {fp32_val:.5f}, int8 {int8_val:.5f}, delta {int8_val - fp32_val:+.5f}")
+
+    # Save the quantized model, remember the engine it was calibrated for
+    out_path = os.path.splitext(model_path)[0] + '-int8.pt'
+    torch.jit.save(torch.jit.script(int8_model), out_path, _extra_files={'quant_engine': args.engine})
+    print(f"Quantized model saved to {out_path}")
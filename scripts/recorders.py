@@ -0,0 +1,317 @@
+"""
+Recording backends for collect_data.py.
+BinaryRecorder appends raw uint8 frames and float32 (steer, throttle, timestamp)
+labels to preallocated, memory-mappable .npy chunks in the session directory:
+    index.json           frame shape, chunk size, frame count, start time
+    frames-00000.npy     (chunk_frames, H, W, 3) uint8
+    labels-00000.npy     (chunk_frames, 3) float32, timestamp is seconds since start
+Frames are batched in the control loop and written by a background thread.
+JpegRecorder keeps the images/<i>.jpg + labels.csv layout, but encodes and
+writes on a worker pool so the control loop only enqueues.
+Convert a binary session to the images/ + labels.csv layout train.py reads:
+python recorders.py 2022-02-22-22-22
+"""
+import os
+import sys
+import json
+import csv
+import queue
+import threading
+from time import time, perf_counter
+import numpy as np
+import cv2 as cv
+
+INDEX_FILE = 'index.json'
+
+
+def write_json_atomic(path, obj):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+class BinaryRecorder:
+    """
+    Record into chunked .npy files, see module docstring for the layout.
+    """
+    def __init__(self, session_dir, chunk_frames=1000, batch_frames=20, num_batches=8):
+        os.makedirs(session_dir, exist_ok=True)
+        self.session_dir = session_dir
+        self.chunk_frames = chunk_frames
+        self.batch_frames = batch_frames
+        self.num_batches = num_batches
+        self.start_stamp = time()
+        self.frame_shape = None
+        self.count = 0  # frames on disk
+        self.dropped = 0  # frames lost because the writer fell behind
+        self.write_time = 0.  # seconds spent by the writer
+        self._chunks = []
+        self._frames_mm = None
+        self._labels_mm = None
+        self._batch = None
+        self._batch_len = 0
+        self._free = queue.Queue()
+        self._todo = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name='recorder', daemon=True)
+        self._writer.start()
+
+    def _allocate(self, frame_shape):
+        self.frame_shape = tuple(frame_shape)
+        for _ in range(self.num_batches):
+            self._free.put((
+                np.empty((self.batch_frames,) + self.frame_shape, dtype=np.uint8),
+                np.empty((self.batch_frames, 3), dtype=np.float32),
+            ))
+        self._batch = self._free.get()
+
+    def append(self, frame, steering, throttle):
+        """
+        Copy one frame and its labels into the current batch. Never blocks.
+        """
+        if self.frame_shape is None:
+            self._allocate(frame.shape)
+        if self._batch is None:  # all buffers are queued for writing
+            try:
+                self._batch = self._free.get_nowait()
+            except queue.Empty:
+                self.dropped += 1
+                return
+        frames, labels = self._batch
+        frames[self._batch_len] = frame
+        labels[self._batch_len] = (steering, throttle, time() - self.start_stamp)
+        self._batch_len += 1
+        if self._batch_len == self.batch_frames:
+            self._submit()
+
+    def _submit(self):
+        if self._batch is not None and self._batch_len:
+            self._todo.put((self._batch, self._batch_len))
+            self._batch = None
+            self._batch_len = 0
+            try:
+                self._batch = self._free.get_nowait()
+            except queue.Empty:
+                pass
+
+    def _open_chunk(self):
+        chunk_id = len(self._chunks)
+        names = {
+            'frames': f'frames-{chunk_id:05d}.npy',
+            'labels': f'labels-{chunk_id:05d}.npy',
+        }
+        self._frames_mm = np.lib.format.open_memmap(
+            os.path.join(self.session_dir, names['frames']),
+            mode='w+', dtype=np.uint8, shape=(self.chunk_frames,) + self.frame_shape,
+        )
+        self._labels_mm = np.lib.format.open_memmap(
+            os.path.join(self.session_dir, names['labels']),
+            mode='w+', dtype=np.float32, shape=(self.chunk_frames, 3),
+        )
+        names['count'] = 0
+        self._chunks.append(names)
+
+    def _write_loop(self):
+        while True:
+            item = self._todo.get()
+            if item is None:
+                break
+            t0 = perf_counter()
+            (frames, labels), num = item
+            done = 0
+            while done < num:
+                if not self._chunks or self._chunks[-1]['count'] == self.chunk_frames:
+                    self._flush_chunk()
+                    self._open_chunk()
+                chunk = self._chunks[-1]
+                n = min(num - done, self.chunk_frames - chunk['count'])
+                self._frames_mm[chunk['count']:chunk['count'] + n] = frames[done:done + n]
+                self._labels_mm[chunk['count']:chunk['count'] + n] = labels[done:done + n]
+                chunk['count'] += n
+                done += n
+            self.count += num
+            self._write_index()
+            self._free.put((frames, labels))
+            self.write_time += perf_counter() - t0
+
+    def _flush_chunk(self):
+        if self._frames_mm is not None:
+            self._frames_mm.flush()
+            self._labels_mm.flush()
+
+    def _write_index(self):
+        write_json_atomic(os.path.join(self.session_dir, INDEX_FILE), {
+            'version': 1,
+            'frame_shape': list(self.frame_shape),
+            'chunk_frames': self.chunk_frames,
+            'count': self.count,
+            'start_time': self.start_stamp,
+            'chunks': self._chunks,
+        })
+
+    def close(self):
+        """
+        Write out the partial batch and wait for the writer to finish.
+        """
+        self._submit()
+        self._todo.put(None)
+        self._writer.join()
+        self._flush_chunk()
+        self._frames_mm = None
+        self._labels_mm = None
+
+    def stats(self):
+        return {
+            'recorded': self.count,
+            'queued': self._todo.qsize() * self.batch_frames,
+            'dropped': self.dropped,
+            'write_ms': 1000 * self.write_time / self.count if self.count else 0.,
+        }
+
+
+class JpegRecorder:
+    """
+    Record into images/<i>.jpg and labels.csv through a bounded queue.
+    Worker threads encode the JPEGs, one CSV handle stays open for the session.
+    Rows are written in frame order, whichever encode finishes first: a row
+    waits for the rows of the earlier frames, as readers take row order for time.
+    """
+    def __init__(self, session_dir, num_workers=2, max_queue=40):
+        self.image_dir = os.path.join(session_dir, 'images')
+        os.makedirs(self.image_dir, exist_ok=True)
+        self._csv_file = open(os.path.join(session_dir, 'labels.csv'), 'a+', newline='')
+        self._csv_writer = csv.writer(self._csv_file)
+        self._csv_lock = threading.Lock()
+        self._pending = {}  # frame id -> (row, enqueue time), encoded ahead of an earlier frame
+        self._next_row = 0  # frame id of the next row to write
+        self._todo = queue.Queue(maxsize=max_queue)
+        self.next_id = 0
+        self.count = 0
+        self.dropped = 0
+        self.max_queued = 0
+        self.write_time = 0.  # seconds from enqueue to row on disk, summed
+        self.max_write_time = 0.
+        self._workers = [
+            threading.Thread(target=self._write_loop, name=f'jpeg-{i}', daemon=True)
+            for i in range(num_workers)
+        ]
+        for w in self._workers:
+            w.start()
+
+    def append(self, frame, steering, throttle):
+        """
+        Enqueue one frame and its labels. Drops the frame when the queue is full.
+        """
+        try:
+            self._todo.put_nowait((self.next_id, frame, steering, throttle, perf_counter()))
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.next_id += 1
+        self.max_queued = max(self.max_queued, self._todo.qsize())
+
+    def _write_loop(self):
+        while True:
+            item = self._todo.get()
+            if item is None:
+                break
+            frame_id, frame, steering, throttle, t_enqueue = item
+            image_name = f'{frame_id}.jpg'
+            cv.imwrite(os.path.join(self.image_dir, image_name), frame)
+            with self._csv_lock:
+                self._pending[frame_id] = ([image_name, steering, throttle], t_enqueue)
+                while self._next_row in self._pending:
+                    row, t_enqueue = self._pending.pop(self._next_row)
+                    self._csv_writer.writerow(row)
+                    self._next_row += 1
+                    self.count += 1
+                    latency = perf_counter() - t_enqueue
+                    self.write_time += latency
+                    self.max_write_time = max(self.max_write_time, latency)
+
+    def close(self):
+        """
+        Drain the queue, stop the workers and flush labels.csv.
+        """
+        for _ in self._workers:
+            self._todo.put(None)
+        for w in self._workers:
+            w.join()
+        self._csv_file.flush()
+        os.fsync(self._csv_file.fileno())
+        self._csv_file.close()
+
+    def stats(self):
+        return {
+            'recorded': self.count,
+            'queued': self._todo.qsize(),
+            'max_queued': self.max_queued,
+            'dropped': self.dropped,
+            'write_ms': 1000 * self.write_time / self.count if self.count else 0.,
+            'max_write_ms': 1000 * self.max_write_time,
+        }
+
+
+class RecordedSession:
+    """
+    Read a session written by BinaryRecorder through memory maps.
+    """
+    def __init__(self, session_dir):
+        self.session_dir = session_dir
+        with open(os.path.join(session_dir, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self._frames = []
+        labels = []
+        for chunk in self.index['chunks']:
+            if not chunk['count']:
+                continue
+            frames_mm = np.load(os.path.join(session_dir, chunk['frames']), mmap_mode='c')
+            labels_mm = np.load(os.path.join(session_dir, chunk['labels']), mmap_mode='c')
+            self._frames.append(frames_mm[:chunk['count']])
+            labels.append(labels_mm[:chunk['count']])
+        self.labels = np.concatenate(labels) if labels else np.empty((0, 3), np.float32)
+        self._offsets = np.cumsum([0] + [len(f) for f in self._frames])
+
+    def __len__(self):
+        return len(self.labels)
+
+    def frame(self, idx):
+        c = np.searchsorted(self._offsets, idx, side='right') - 1
+        return self._frames[c][idx - self._offsets[c]]
+
+    def chunks(self):
+        """
+        Iterate (first index, frames) over the memory-mapped chunks.
+        """
+        for offset, frames in zip(self._offsets, self._frames):
+            yield int(offset), frames
+
+
+def is_binary_session(session_dir):
+    return os.path.isfile(os.path.join(session_dir, INDEX_FILE))
+
+
+def convert_to_images(session_dir):
+    """
+    Write images/<i>.jpg and labels.csv next to the binary recording.
+    """
+    session = RecordedSession(session_dir)
+    image_dir = os.path.join(session_dir, 'images')
+    os.makedirs(image_dir, exist_ok=True)
+    with open(os.path.join(session_dir, 'labels.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        for offset, frames in session.chunks():
+            for i, frame in enumerate(frames):
+                cv.imwrite(os.path.join(image_dir, f'{offset + i}.jpg'), frame)
+                st, th, _ = session.labels[offset + i]
+                writer.writerow([f'{offset + i}.jpg', round(float(st), 2), round(float(th), 2)])
+    return len(session)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('Converter needs a data directory name, e.g. python recorders.py 2022-02-22-22-22')
+        sys.exit(1)
+    session_dir = os.path.join(os.path.dirname(sys.path[0]), 'data', sys.argv[1])
+    num_frames = convert_to_images(session_dir)
+    print(f"Converted {num_frames} frames in {session_dir}")
@@ -0,0 +1,159 @@
+"""
+Label-balanced sampling for train.py.
+Steering and throttle labels are binned into a 2D histogram once, every
+sample is weighted by the inverse count of its bin (power=1 balances fully,
+0 samples uniformly) and indices are drawn with replacement from an alias
+table, O(1) per draw. An epoch has num_samples draws, independent of the
+dataset size if given.
+Sessions compacted by compact.py have a weights.npy: the length of the run
+of near-duplicate frames each kept frame replaced. Frames are weighted by
+run length ** run_power, so 0 counts a run once and 1 as often as recorded.
+Print the steering histogram of a session before and after balancing:
+python samplers.py 2022-02-22-22-22
+"""
+import os
+import sys
+import numpy as np
+from torch.utils.data import Sampler, Subset, ConcatDataset
+import datasets
+
+LABEL_RANGE = (-1., 1.)  # steering and throttle actions
+RUN_WEIGHTS_FILE = 'weights.npy'  # written by compact.py
+
+
+def dataset_labels(dataset):
+    """
+    (N, 2) steering, throttle of a session dataset, a ConcatDataset of them or
+    a Subset (random_split) of either, without loading any frame.
+    """
+    if isinstance(dataset, Subset):
+        return dataset_labels(dataset.dataset)[np.asarray(dataset.indices)]
+    if isinstance(dataset, ConcatDataset):
+        return np.concatenate([dataset_labels(d) for d in dataset.datasets])
+    if hasattr(dataset, 'labels'):  # frame cache or binary session
+        return np.asarray(dataset.labels, dtype=np.float32)[:, :2]
+    return dataset.img_labels.iloc[:, 1:3].to_numpy(dtype=np.float32)
+
+
+def session_dir(dataset):
+    """
+    Directory of a session dataset, see datasets.load_session().
+    """
+    if hasattr(dataset, 'session_dir'):  # binary session
+        return dataset.session_dir
+    return os.path.dirname(os.path.normpath(dataset.img_dir))
+
+
+def dataset_run_lengths(dataset):
+    """
+    (N,) run lengths from compact.py for the samples of dataset, like
+    dataset_labels(), 1 for sessions that were not compacted. None if no
+    session was compacted.
+    """
+    if isinstance(dataset, Subset):
+        runs = dataset_run_lengths(dataset.dataset)
+        return None if runs is None else runs[np.asarray(dataset.indices)]
+    if isinstance(dataset, ConcatDataset):
+        runs = [dataset_run_lengths(d) for d in dataset.datasets]
+        if all(r is None for r in runs):
+            return None
+        return np.concatenate([np.ones(len(d)) if r is None else r for d, r in zip(dataset.datasets, runs)])
+    path = os.path.join(session_dir(dataset), RUN_WEIGHTS_FILE)
+    return np.load(path).astype(np.float64) if os.path.isfile(path) else None
+
+
+def bin_index(labels, bins=(21, 5)):
+    """
+    Flat 2D histogram bin of every (steering, throttle) row.
+    """
+    low, high = LABEL_RANGE
+    scaled = (np.asarray(labels, dtype=np.float32) - low) / (high - low)
+    idx = np.clip((scaled * bins).astype(np.int64), 0, np.array(bins) - 1)
+    return idx[:, 0] * bins[1] + idx[:, 1]
+
+
+def label_weights(labels, bins=(21, 5), power=1., max_weight=10.):
+    """
+    Per sample weights, mean 1: inverse bin count to the given power,
+    capped at max_weight times the mean so rare outliers do not dominate.
+    """
+    flat = bin_index(labels, bins)
+    counts = np.bincount(flat, minlength=bins[0] * bins[1])
+    weights = counts[flat].astype(np.float64) ** -power
+    weights /= weights.mean()
+    np.minimum(weights, max_weight, out=weights)
+    return weights / weights.mean()
+
+
+class AliasTable:
+    """
+    Walker/Vose alias method: O(n) setup, O(1) weighted draws.
+    """
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(weights)
+        scaled = weights * n / weights.sum()
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+        small = list(np.flatnonzero(scaled < 1.))
+        large = list(np.flatnonzero(scaled >= 1.))
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1. - scaled[s]
+            (small if scaled[l] < 1. else large).append(l)
+        # leftovers are 1 up to rounding, prob and alias already say so
+
+    def __len__(self):
+        return len(self.prob)
+
+    def draw(self, size, rng):
+        column = rng.integers(len(self.prob), size=size)
+        return np.where(rng.random(size) < self.prob[column], column, self.alias[column])
+
+
+class BalancedSampler(Sampler):
+    """
+    Index stream for DataLoader(sampler=...), weighted by label_weights()
+    and, if given, by run_lengths ** run_power (see dataset_run_lengths()).
+    num_samples: draws per epoch, defaults to the number of samples.
+    """
+    def __init__(self, labels, num_samples=None, bins=(21, 5), power=1., max_weight=10., seed=0,
+                 run_lengths=None, run_power=.5):
+        self.weights = label_weights(labels, bins, power, max_weight)
+        if run_lengths is not None:
+            self.weights = self.weights * np.asarray(run_lengths, dtype=np.float64) ** run_power
+        self.table = AliasTable(self.weights)
+        self.num_samples = num_samples or len(self.weights)
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        return self.num_samples
+
+    def __iter__(self):
+        rng = np.random.default_rng((self.seed, self.epoch))
+        self.epoch += 1
+        for start in range(0, self.num_samples, 8192):  # vectorized draws, a block at a time
+            yield from self.table.draw(min(8192, self.num_samples - start), rng).tolist()
+
+
+if __name__ == '__main__':
+    from time import perf_counter
+    data_dir = os.path.join(os.path.dirname(sys.path[0]), 'data', sys.argv[1])
+    labels = dataset_labels(datasets.load_session(data_dir, raw=True))
+    start_stamp = perf_counter()
+    sampler = BalancedSampler(labels)
+    setup_time = perf_counter() - start_stamp
+    start_stamp = perf_counter()
+    drawn = np.fromiter(iter(sampler), dtype=np.int64, count=len(sampler))
+    draw_time = perf_counter() - start_stamp
+    print(f"{len(labels)} samples, alias table in {1000 * setup_time:.1f} ms, "
+          f"one epoch of draws in {1000 * draw_time:.1f} ms")
+    edges = np.linspace(*LABEL_RANGE, 11)
+    before, _ = np.histogram(labels[:, 0], edges)
+    after, _ = np.histogram(labels[drawn, 0], edges)
+    print("steering      recorded  balanced")
+    for i in range(len(before)):
+        print(f"{edges[i]:+.1f}..{edges[i + 1]:+.1f} {before[i]:9d} {after[i]:9d}")
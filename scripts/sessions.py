@@ -0,0 +1,172 @@
+"""
+Index of many recorded sessions and a streaming dataset across them.
+Every session is read through its memory-mapped frames (see datasets.py),
+so memory use does not grow with the number of frames in the corpus.
+Print the index of some (default: all) sessions under data/:
+python sessions.py [2022-02-22-22-22 ...]
+"""
+import os
+import sys
+import json
+import hashlib
+import numpy as np
+from torch.utils.data import IterableDataset, get_worker_info
+import datasets
+import recorders
+
+INDEX_FILE = 'sessions.json'
+
+
+def session_hash(data_dir):
+    """
+    Content hash of a session: the cache fingerprint or the binary index.
+    """
+    manifest_path = os.path.join(data_dir, 'cache', 'manifest.json')
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)['fingerprint']
+    with open(os.path.join(data_dir, recorders.INDEX_FILE), 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def session_metadata(data_dir):
+    dataset = datasets.load_session(data_dir, raw=True)  # builds the frame cache if needed
+    labels = np.asarray(dataset.labels, dtype=np.float32)
+    stats = {}
+    for i, name in enumerate(('steering', 'throttle')):
+        column = labels[:, i]
+        stats[name] = {
+            'mean': float(column.mean()),
+            'std': float(column.std()),
+            'min': float(column.min()),
+            'max': float(column.max()),
+        }
+    return {
+        'name': os.path.basename(os.path.normpath(data_dir)),
+        'num_frames': len(dataset),
+        'labels': stats,
+        'hash': session_hash(data_dir),
+    }
+
+
+def build_index(data_root, names=None):
+    """
+    Metadata of the named sessions (default: all), also saved to data/sessions.json.
+    """
+    if names is None:
+        names = sorted(
+            n for n in os.listdir(data_root)
+            if os.path.isfile(os.path.join(data_root, n, 'labels.csv'))
+            or recorders.is_binary_session(os.path.join(data_root, n))
+        )
+    index_path = os.path.join(data_root, INDEX_FILE)
+    index = {}
+    if os.path.isfile(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+    for name in names:
+        index[name] = session_metadata(os.path.join(data_root, name))
+    recorders.write_json_atomic(index_path, index)
+    return [index[name] for name in names]
+
+
+def in_test_split(indices, session_seed, test_fraction):
+    """
+    Deterministic, memory free train/test assignment of frame indices.
+    """
+    indices = np.asarray(indices, dtype=np.uint64)
+    mixed = (indices * np.uint64(2654435761) + np.uint64(session_seed)) % np.uint64(1000)
+    return mixed < np.uint64(round(test_fraction * 1000))
+
+
+class StreamingSessionDataset(IterableDataset):
+    """
+    Stream (frame, steering, throttle) samples across many sessions.
+    Sessions are read in contiguous blocks for memory-map locality. Block
+    order is shuffled every epoch, a shuffle buffer mixes samples across
+    blocks. weights repeat (>1) or subsample (<1) the blocks of a session.
+    """
+    def __init__(self, data_dirs, split='train', test_fraction=.1, weights=None, shuffle_buffer=2000,
+                 block_size=256, seed=0, raw=False):
+        self.sessions = [datasets.load_session(d, raw=True) for d in data_dirs]
+        self.weights = weights if weights is not None else [1.] * len(data_dirs)
+        self.split = split
+        self.test_fraction = test_fraction
+        self.shuffle_buffer = shuffle_buffer
+        self.block_size = block_size
+        self.seed = seed
+        self.raw = raw
+        self.epoch = 0
+        self._session_seeds = [
+            int(hashlib.sha1(os.path.basename(os.path.normpath(d)).encode()).hexdigest()[:8], 16)
+            for d in data_dirs
+        ]
+        self._num_samples = 0
+        for s, session in enumerate(self.sessions):
+            n_split = int(in_test_split(np.arange(len(session)), self._session_seeds[s], test_fraction).sum())
+            if split == 'train':
+                n_split = len(session) - n_split
+            self._num_samples += int(n_split * self.weights[s])
+
+    def __len__(self):
+        """
+        Expected samples per epoch, exact for weights of 1.
+        """
+        return self._num_samples
+
+    def _blocks(self, rng):
+        blocks = []
+        for s, session in enumerate(self.sessions):
+            starts = np.arange(0, len(session), self.block_size)
+            whole, frac = divmod(self.weights[s], 1)
+            picked = np.concatenate([np.repeat(starts, int(whole)), starts[rng.random(len(starts)) < frac]])
+            blocks.extend((s, int(start)) for start in picked)
+        rng.shuffle(blocks)
+        return blocks
+
+    def _samples(self, blocks, rng):
+        for s, start in blocks:
+            session = self.sessions[s]
+            idx = np.arange(start, min(start + self.block_size, len(session)))
+            test_mask = in_test_split(idx, self._session_seeds[s], self.test_fraction)
+            idx = idx[test_mask] if self.split == 'test' else idx[~test_mask]
+            rng.shuffle(idx)
+            for i in idx:
+                yield session[int(i)]
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker else (0, 1)
+        # Same block order in every worker, each takes its own share
+        blocks = self._blocks(np.random.default_rng((self.seed, self.epoch)))[worker_id::num_workers]
+        rng = np.random.default_rng((self.seed, self.epoch, worker_id))
+        self.epoch += 1
+        buffer = []
+        for sample in self._samples(blocks, rng):
+            if self.split == 'train' and self.shuffle_buffer > 1:
+                if len(buffer) < self.shuffle_buffer:
+                    buffer.append(sample)
+                    continue
+                j = rng.integers(len(buffer))
+                buffer[j], sample = sample, buffer[j]
+            yield self._convert(sample)
+        rng.shuffle(buffer)
+        for sample in buffer:
+            yield self._convert(sample)
+
+    def _convert(self, sample):
+        frame, steering, throttle = sample
+        return (frame if self.raw else datasets.to_tensor(frame)), steering, throttle
+
+
+if __name__ == '__main__':
+    data_root = os.path.join(os.path.dirname(sys.path[0]), 'data')
+    index = build_index(data_root, sys.argv[1:] or None)
+    total = 0
+    for meta in index:
+        st, th = meta['labels']['steering'], meta['labels']['throttle']
+        print(f"{meta['name']}: {meta['num_frames']} frames, "
+              f"steering {st['mean']:+.3f}±{st['std']:.3f}, throttle {th['mean']:+.3f}±{th['std']:.3f}, "
+              f"hash {meta['hash'][:10]}")
+        total += meta['num_frames']
+    print(f"{len(index)} sessions, {total} frames, index saved to {os.path.join(data_root, INDEX_FILE)}")
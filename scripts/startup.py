@@ -0,0 +1,62 @@
+"""
+Where the seconds between starting a script and driving go.
+Phases may run on different threads, the report lists them in start order
+on one timeline, together with the time the interpreter took before.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+
+def process_age():
+    """
+    Seconds since this process started, None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])  # field 22, starttime
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+
+
+class StartupTimer:
+    def __init__(self):
+        self.start_stamp = perf_counter()
+        self.before = process_age()  # interpreter start up and the imports before this
+        self.phases = []  # (name, thread, start, end), seconds since start_stamp
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter() - self.start_stamp
+        try:
+            yield
+        finally:
+            self.add(name, start, perf_counter() - self.start_stamp)
+
+    def mark(self, name):
+        """
+        An instant, e.g. the first command sent.
+        """
+        now = perf_counter() - self.start_stamp
+        self.add(name, now, now)
+
+    def add(self, name, start, end):
+        with self._lock:
+            self.phases.append((name, threading.current_thread().name, start, end))
+
+    def total(self):
+        return max((end for _, _, _, end in self.phases), default=0.) + (self.before or 0.)
+
+    def report(self):
+        lines = []
+        if self.before is not None:
+            lines.append(f"{'python start':<24} {'':<12} {-self.before:6.2f} -> {0:6.2f} s  ({self.before:.2f} s)")
+        for name, thread, start, end in sorted(self.phases, key=lambda p: p[2]):
+            lines.append(f"{name:<24} {thread:<12} {start:6.2f} -> {end:6.2f} s  ({end - start:.2f} s)")
+        lines.append(f"{'total':<24} {'':<12} {self.total():.2f} s")
+        return '\n'.join(lines)
@@ -0,0 +1,199 @@
+"""
+Hyperparameter sweep over train.py.
+Every trial is a train.py process with its own options and output directory,
+--jobs trials run at once and the CPU threads are split between them. The
+frame cache of every session is built before the first trial starts, so all
+trials memory-map the same decoded frames.
+A trial is pruned (interrupted) when, after --warmup epochs, its best test
+loss so far is worse than the median of the other trials at the same epoch.
+Results go to data/<first datetime>/sweeps/<name>/results.csv, the model of
+the best trial is copied next to it under its own name, which tells
+inference.load_model() its architecture.
+Search space: option=v1,v2,... for any train.py option, all combinations
+(grid) or --random N draws, where option=log:low:high samples log-uniformly.
+Options after -- are passed to every trial unchanged, e.g.
+python sweep.py 2022-02-22-22-22 --jobs 2 --space lr=0.001,0.0003 batch-size=64,125 -- --batch-collate
+python sweep.py 2022-02-22-22-22 --random 8 --space lr=log:1e-4:3e-3 weight-decay=0,1e-4 epochs=20
+"""
+import os
+import sys
+import re
+import csv
+import json
+import shutil
+import signal
+import argparse
+import itertools
+import threading
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import datasets
+
+EPOCH_LINE = re.compile(r'^epoch (\d+) training loss: \S+, testing loss: ([\d.eE+-]+|nan|inf)')
+
+
+def parse_space(items):
+    """
+    ['lr=0.001,0.0003', 'lr=log:1e-4:1e-2', ...] -> {option: list of values or ('log', low, high)}
+    """
+    space = {}
+    for item in items:
+        name, _, values = item.partition('=')
+        if not values:
+            raise ValueError(f"{item}: expected option=value[,value...]")
+        if values.startswith('log:'):
+            low, high = (float(v) for v in values[4:].split(':'))
+            space[name] = ('log', low, high)
+        else:
+            space[name] = values.split(',')
+    return space
+
+
+def make_trials(space, num_random=None, seed=0):
+    """
+    List of {option: value} for every trial.
+    """
+    if num_random is None:
+        if any(isinstance(v, tuple) for v in space.values()):
+            raise ValueError("log:low:high ranges need --random")
+        names = list(space)
+        return [dict(zip(names, combo)) for combo in itertools.product(*space.values())]
+    rng = np.random.default_rng(seed)
+    trials = []
+    for _ in range(num_random):
+        trial = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                _, low, high = values
+                trial[name] = f"{np.exp(rng.uniform(np.log(low), np.log(high))):.3g}"
+            else:
+                trial[name] = values[rng.integers(len(values))]
+        trials.append(trial)
+    return trials
+
+
+class MedianPruner:
+    """
+    Best test loss so far of every trial at every epoch, shared by the trial threads.
+    """
+    def __init__(self, warmup=3, min_trials=3):
+        self.warmup = warmup
+        self.min_trials = min_trials
+        self._lock = threading.Lock()
+        self._best = {}  # epoch -> {trial id: best loss up to that epoch}
+
+    def report(self, trial_id, epoch, best_loss):
+        """
+        Record a trial's epoch, True if the trial should stop.
+        """
+        with self._lock:
+            others = [v for k, v in self._best.get(epoch, {}).items() if k != trial_id]
+            self._best.setdefault(epoch, {})[trial_id] = best_loss
+        if epoch < self.warmup or len(others) < self.min_trials - 1:
+            return False
+        return best_loss > np.median(others)
+
+
+def run_trial(trial_id, options, train_args, trial_dir, threads, pruner):
+    """
+    Run train.py for one trial, return its row for the results table.
+    """
+    os.makedirs(trial_dir, exist_ok=True)
+    cmd = [sys.executable, os.path.join(sys.path[0], 'train.py'), *train_args,
+           '--out', trial_dir, '--threads', str(threads)]
+    for name, value in options.items():
+        cmd += [f'--{name}', str(value)]
+    env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+    row = {'trial': trial_id, **options, 'status': 'failed', 'epochs_run': 0, 'best_test_loss': float('inf')}
+    best_loss = float('inf')
+    epoch = 0
+    with open(os.path.join(trial_dir, 'train.log'), 'w') as log:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env)
+        pruned = False
+        for line in proc.stdout:
+            log.write(line)
+            match = EPOCH_LINE.match(line)
+            if match and not pruned:
+                epoch = int(match.group(1))
+                best_loss = min(best_loss, float(match.group(2)))
+                if pruner is not None and pruner.report(trial_id, epoch, best_loss):
+                    pruned = True
+                    proc.send_signal(signal.SIGINT)  # train.py keeps its last checkpoint
+        proc.wait()
+    row['epochs_run'] = epoch
+    row['best_test_loss'] = best_loss
+    if pruned:
+        row['status'] = 'pruned'
+    elif proc.returncode == 0:
+        summary_files = [f for f in os.listdir(trial_dir) if f.endswith('.json')]
+        with open(os.path.join(trial_dir, summary_files[0])) as f:
+            summary = json.load(f)
+        row.update(
+            status='done',
+            epochs_run=summary['epochs_run'],
+            best_epoch=summary['best_epoch'],
+            best_test_loss=summary['best_test_loss'],
+            mean_epoch_time=round(summary['mean_epoch_time'], 3),
+            model_path=os.path.join(trial_dir, summary_files[0][:-len('.json')] + '.pth'),
+        )
+    print(f"trial {trial_id} {options}: {row['status']} after {row['epochs_run']} epochs, "
+          f"best test loss {row['best_test_loss']:.5f}")
+    return row
+
+
+if __name__ == '__main__':
+    argv, train_args = sys.argv[1:], []
+    if '--' in argv:
+        argv, train_args = argv[:argv.index('--')], argv[argv.index('--') + 1:]
+    parser = argparse.ArgumentParser(description="Hyperparameter sweep over train.py")
+    parser.add_argument('data_datetime', nargs='+', help="session(s) under data/, e.g. 2022-02-22-22-22")
+    parser.add_argument('--space', nargs='+', required=True, metavar='OPTION=VALUES',
+                        help="train.py options to search, e.g. lr=0.001,0.0003 or lr=log:1e-4:1e-2")
+    parser.add_argument('--random', type=int, default=None, help="random search with this many trials, not a grid")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random search")
+    parser.add_argument('--jobs', type=int, default=2, help="trials running at once")
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help="CPU threads shared by the trials")
+    parser.add_argument('--warmup', type=int, default=3, help="epochs before a trial can be pruned")
+    parser.add_argument('--min-trials', type=int, default=3, help="trials reporting an epoch before pruning at it")
+    parser.add_argument('--no-prune', action='store_true')
+    parser.add_argument('--name', default=None, help="sweep name, default: the current date and time")
+    args = parser.parse_args(argv)
+    try:
+        trials = make_trials(parse_space(args.space), args.random, args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+    data_root = os.path.join(os.path.dirname(sys.path[0]), 'data')
+    sweep_dir = os.path.join(
+        data_root, args.data_datetime[0], 'sweeps', args.name or datetime.now().strftime("%Y-%m-%d-%H-%M")
+    )
+    os.makedirs(sweep_dir, exist_ok=True)
+    # Decode every session once before the trials start, they all map the same cache
+    for d in args.data_datetime:
+        if '--no-cache' not in train_args:
+            datasets.load_session(os.path.join(data_root, d))
+    threads = max(1, args.threads // args.jobs)
+    pruner = None if args.no_prune else MedianPruner(args.warmup, args.min_trials)
+    print(f"{len(trials)} trials, {args.jobs} at a time with {threads} threads each, results in {sweep_dir}")
+    with ThreadPoolExecutor(args.jobs) as pool:  # each thread waits on one train.py process
+        rows = list(pool.map(
+            lambda i: run_trial(i, trials[i], args.data_datetime + train_args,
+                                os.path.join(sweep_dir, f'trial-{i:03d}'), threads, pruner),
+            range(len(trials)),
+        ))
+    rows.sort(key=lambda r: (r['status'] != 'done', r['best_test_loss']))
+    columns = ['trial', *trials[0], 'status', 'epochs_run', 'best_epoch', 'best_test_loss', 'mean_epoch_time', 'model_path']
+    with open(os.path.join(sweep_dir, 'results.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, restval='')
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"{'trial':>5} " + ' '.join(f"{name:>14}" for name in trials[0]) + "     status  epochs  best loss")
+    for r in rows:
+        print(f"{r['trial']:5d} " + ' '.join(f"{r[name]:>14}" for name in trials[0])
+              + f" {r['status']:>10} {r['epochs_run']:7d}  {r['best_test_loss']:.5f}")
+    if rows and rows[0]['status'] == 'done':
+        best_model = shutil.copy(rows[0]['model_path'], sweep_dir)  # keeps the <ModelName>- prefix
+        print(f"Best trial {rows[0]['trial']}: {trials[rows[0]['trial']]}, model copied to {best_model}")
+    else:
+        print("No trial finished")
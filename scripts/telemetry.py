@@ -0,0 +1,118 @@
+"""
+Low overhead timing of the control loop.
+Every frame gets a row in a fixed size ring buffer, every stage writes its
+start and end (perf_counter seconds) into that row: two float stores per
+stage, no allocation, no lock (each stage owns its column). Statistics and
+traces are computed from a snapshot only when asked for.
+
+    telemetry = Telemetry(('capture', 'preprocess', 'infer', 'encode', 'serial write'))
+    telemetry.record(frame_id, 'infer', t0, t1)
+    print(telemetry.report())
+    telemetry.export_chrome_trace('trace.json')  # open in ui.perfetto.dev or chrome://tracing
+"""
+import json
+from time import perf_counter
+import numpy as np
+
+
+class Telemetry:
+    def __init__(self, stages, capacity=2048):
+        self.stages = tuple(stages)
+        self.capacity = capacity
+        self._index = {name: i for i, name in enumerate(self.stages)}
+        self._stamps = np.full((capacity, len(self.stages), 2), np.nan)
+        self._frame_ids = np.full(capacity, -1, dtype=np.int64)
+        self.start_stamp = perf_counter()
+
+    def record(self, frame_id, stage, start, end):
+        """
+        Stamps of one stage of one frame. The first stage starts a new row,
+        stamps for a frame already pushed out of the ring are ignored.
+        """
+        col = self._index.get(stage)
+        if col is None:
+            return
+        row = frame_id % self.capacity
+        if col == 0:
+            self._stamps[row] = np.nan
+            self._frame_ids[row] = frame_id
+        elif self._frame_ids[row] != frame_id:
+            return
+        self._stamps[row, col, 0] = start
+        self._stamps[row, col, 1] = end
+
+    def snapshot(self):
+        """
+        (frame ids, stamps) of the frames in the ring, oldest first.
+        """
+        ids = self._frame_ids.copy()
+        stamps = self._stamps.copy()
+        valid = ids >= 0
+        order = np.argsort(ids[valid])
+        return ids[valid][order], stamps[valid][order]
+
+    @staticmethod
+    def _percentiles(seconds):
+        if not len(seconds):
+            return None
+        p50, p95, p99 = 1000 * np.percentile(seconds, (50, 95, 99))
+        return {'p50': p50, 'p95': p95, 'p99': p99, 'max': 1000 * seconds.max(), 'jitter': 1000 * seconds.std()}
+
+    def summary(self):
+        """
+        Milliseconds: per stage duration, latency from the end of the first
+        stage to the end of the last one and the period between completed frames. jitter is the standard deviation.
+        """
+        _, stamps = self.snapshot()
+        summary = {'frames': len(stamps)}
+        durations = stamps[:, :, 1] - stamps[:, :, 0]
+        for i, name in enumerate(self.stages):
+            stage = durations[:, i]
+            summary[name] = self._percentiles(stage[~np.isnan(stage)])
+        complete = ~np.isnan(stamps[:, 0, 1]) & ~np.isnan(stamps[:, -1, 1])  # stages in between may be skipped
+        latency = stamps[complete, -1, 1] - stamps[complete, 0, 1]  # from the frame, not the wait for it
+        summary['latency'] = self._percentiles(latency)
+        summary['period'] = self._percentiles(np.diff(np.sort(stamps[complete, -1, 1])))
+        return summary
+
+    def report(self):
+        """
+        One line per stage, for the console.
+        """
+        summary = self.summary()
+        lines = [f"{summary['frames']} frames (ms)      p50     p95     p99     max  jitter"]
+        for name in self.stages + ('latency', 'period'):
+            stats = summary[name]
+            if stats is None:
+                continue
+            lines.append(f"{name:<16}" + ''.join(f"{stats[k]:8.2f}" for k in ('p50', 'p95', 'p99', 'max', 'jitter')))
+        if summary['period'] is not None:
+            lines.append(f"{'rate':<16}{1000 / summary['period']['p50']:8.1f} Hz")
+        return '\n'.join(lines)
+
+    def export_chrome_trace(self, path):
+        """
+        Chrome trace event JSON: one track per stage, one slice per frame and stage.
+        """
+        ids, stamps = self.snapshot()
+        events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': i, 'args': {'name': name}}
+            for i, name in enumerate(self.stages)
+        ]
+        for frame_id, row in zip(ids.tolist(), stamps):
+            for i, name in enumerate(self.stages):
+                start, end = row[i]
+                if np.isnan(start):
+                    continue
+                events.append({
+                    'name': name,
+                    'ph': 'X',
+                    'pid': 0,
+                    'tid': i,
+                    'ts': 1e6 * (start - self.start_stamp),
+                    'dur': 1e6 * (end - start),
+                    'args': {'frame': frame_id},
+                })
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return len(events) - len(self.stages)
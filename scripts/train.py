@@ -1,130 +1,394 @@
 import os
 import sys
+import json
+import random
+import argparse
+from time import perf_counter
 import numpy as np
-import pandas as pd
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader, Dataset, random_split
-from torchvision.transforms import v2
+from torch.utils.data import ConcatDataset, IterableDataset
 import matplotlib.pyplot as plt
+import augment
 import convnets
-import cv2 as cv
+import datasets
+import samplers
+import sessions
 
-# Pass in command line arguments for data diretory name
+# Pass in command line arguments for data diretory name(s)
 # e.g. python train.py 2022-02-22-22-22
-if len(sys.argv) != 2:
-    print('Training script needs data!!!')
-    sys.exit(1)  # exit with an error code
-else:
-    data_datetime = sys.argv[1]
+# e.g. python train.py 2022-02-22-22-22 2022-03-03-33-33 --stream --weights 1 2
+# e.g. python train.py 2022-02-22-22-22 --batch-collate --augment flip_prob=0.5 seed=1
+# e.g. python train.py 2022-02-22-22-22 --balance --epoch-samples 20000
+# e.g. python train.py 2022-02-22-22-22 --epochs 30 --patience 4 [--resume after a crash or Ctrl-C]
+# e.g. python train.py 2022-02-22-22-22 --model MobileDonkeyNet
+parser = argparse.ArgumentParser(description="Train a driving model on recorded sessions")
+parser.add_argument('data_datetime', nargs='+', help="session(s) under data/, e.g. 2022-02-22-22-22")
+parser.add_argument('--model', default='DonkeyNet', choices=list(convnets.MODELS),
+                    help="architecture, compare them with profile_models.py")
+parser.add_argument('--stream', action='store_true',
+                    help="stream samples across sessions instead of holding one index over all frames")
+parser.add_argument('--weights', type=float, nargs='+', help="per-session sampling weights, with --stream")
+parser.add_argument('--shuffle-buffer', type=int, default=2000, help="samples mixed in memory, with --stream")
+parser.add_argument('--balance', action='store_true',
+                    help="sample training frames weighted by the inverse frequency of their labels")
+parser.add_argument('--balance-bins', type=int, nargs=2, default=[21, 5], metavar=('STEERING', 'THROTTLE'),
+                    help="label histogram bins, with --balance")
+parser.add_argument('--balance-power', type=float, default=1.,
+                    help="1 balances fully, smaller values move back toward the recorded distribution")
+parser.add_argument('--epoch-samples', type=int, default=None,
+                    help="fixed number of training samples per epoch, drawn with replacement")
+parser.add_argument('--run-power', type=float, default=.5,
+                    help="frames of sessions compacted by compact.py are sampled by run length ** this, "
+                         "0 counts a run of near-duplicates once, 1 as often as recorded")
+parser.add_argument('--no-cache', action='store_true', help="decode JPEGs every epoch instead of caching")
+parser.add_argument('--batch-size', type=int, default=125)
+parser.add_argument('--workers', type=int, default=2, help="data loading processes, 0 loads in the main process")
+parser.add_argument('--prefetch', type=int, default=2, help="batches prefetched by each worker")
+parser.add_argument('--no-pin-memory', action='store_true', help="do not page-lock host batches")
+parser.add_argument('--batch-collate', action='store_true',
+                    help="load uint8 frames and convert a whole batch to float on DEVICE")
+parser.add_argument('--amp', action='store_true',
+                    help="mixed precision: fp16 autocast + grad scaler on CUDA, bf16 autocast on CPU")
+parser.add_argument('--channels-last', action='store_true', help="channels_last model and inputs")
+parser.add_argument('--augment', nargs='*', metavar='KEY=VALUE',
+                    help=f"augment training batches on DEVICE, options: {augment.DEFAULTS}")
+parser.add_argument('--epochs', type=int, default=15)
+parser.add_argument('--lr', type=float, default=0.001)
+parser.add_argument('--weight-decay', type=float, default=0.0001)
+parser.add_argument('--threads', type=int, default=None, help="CPU threads for torch, default: all")
+parser.add_argument('--out', default=None,
+                    help="directory for the model, plot and checkpoints, default: the first session")
+parser.add_argument('--patience', type=int, default=None,
+                    help="stop after this many epochs without a better test loss")
+parser.add_argument('--min-delta', type=float, default=0., help="smallest test loss decrease counted as better")
+parser.add_argument('--checkpoint-every', type=int, default=1, help="epochs between checkpoints")
+parser.add_argument('--resume', action='store_true', help="continue from the last checkpoint of the same run")
+parser.add_argument('--seed', type=int, default=0, help="seeds the train/test split and weight initialization")
+parser.add_argument('--compare', action='store_true',
+                    help="also train the FP32 baseline and report both side by side")
+args = parser.parse_args()
+if args.weights is not None and len(args.weights) != len(args.data_datetime):
+    parser.error("--weights needs one weight per session")
+if args.stream and (args.balance or args.epoch_samples):
+    parser.error("--balance and --epoch-samples need the indexed dataset, not --stream")
+try:
+    augment_config = augment.parse_options(args.augment) if args.augment is not None else None
+except ValueError as e:
+    parser.error(str(e))
+
+if args.threads:
+    torch.set_num_threads(args.threads)
 
 # Designate processing unit for CNN training
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 print(f"Using {DEVICE} device")
 
 
-class BearCartDataset(Dataset):
+def autocast_dtype(amp):
     """
-    Customized dataset
+    Autocast dtype for DEVICE, None means train in FP32.
     """
-    def __init__(self, annotations_file, img_dir):
-        self.img_labels = pd.read_csv(annotations_file)
-        self.img_dir = img_dir
-        self.transform = v2.ToTensor()
+    if not amp:
+        return None
+    if DEVICE == "cuda":
+        return torch.float16
+    try:  # bf16 autocast on CPU is not available with every build
+        with torch.autocast(device_type="cpu", dtype=torch.bfloat16):
+            nn.functional.conv2d(torch.rand(1, 3, 8, 8), torch.rand(4, 3, 3, 3))
+    except RuntimeError:
+        print("bf16 autocast is not supported on this CPU, train in FP32")
+        return None
+    return torch.bfloat16
 
-    def __len__(self):
-        return len(self.img_labels)
 
-    def __getitem__(self, idx):
-        img_path = os.path.join(self.img_dir, self.img_labels.iloc[idx, 0])
-        image = cv.imread(img_path, cv.IMREAD_COLOR)
-        image_tensor = self.transform(image)
-        steering = self.img_labels.iloc[idx, 1].astype(np.float32)
-        throttle = self.img_labels.iloc[idx, 2].astype(np.float32)
-        return image_tensor.float(), steering, throttle
+def prepare_batch(im, st, th, memory_format=torch.contiguous_format):
+    """
+    Copy a batch to DEVICE (asynchronously from pinned memory) and build the target.
+    """
+    target = torch.stack((st, th), dim=-1).to(DEVICE, non_blocking=True)
+    feature = im.to(DEVICE, non_blocking=True)
+    if feature.dtype == torch.uint8:  # batch collate, convert the whole batch at once
+        feature = datasets.frames_to_float(feature, memory_format)
+    else:
+        feature = feature.contiguous(memory_format=memory_format)
+    return feature, target
 
 
-def train(dataloader, model, loss_fn, optimizer):
+def train(dataloader, model, loss_fn, optimizer, scaler, amp_dtype=None,
+          memory_format=torch.contiguous_format, augmenter=None):
     model.train()
     num_used_samples = 0
+    # samples per epoch, the sampler decides unless the dataset streams
+    num_samples = len(dataloader.dataset if isinstance(dataloader.dataset, IterableDataset) else dataloader.sampler)
     ep_loss = 0.
     for b, (im, st, th) in enumerate(dataloader):
-        target = torch.stack((st, th), dim=-1)
-        feature, target = im.to(DEVICE), target.to(DEVICE)
-        pred = model(feature)
-        batch_loss = loss_fn(pred, target)
+        feature, target = prepare_batch(im, st, th, memory_format)
+        if augmenter is not None:  # training batches only, test batches stay as recorded
+            feature, target = augmenter(feature, target)
+        with torch.autocast(device_type=DEVICE, dtype=amp_dtype, enabled=amp_dtype is not None):
+            pred = model(feature)
+            batch_loss = loss_fn(pred, target)
         optimizer.zero_grad()  # zero previous gradient
-        batch_loss.backward()  # back propagation
-        optimizer.step()  # update params
+        scaler.scale(batch_loss).backward()  # back propagation, loss scaled for fp16
+        scaler.step(optimizer)  # update params
+        scaler.update()
         num_used_samples += target.shape[0]
-        print(f"batch loss: {batch_loss.item()} [{num_used_samples}/{len(dataloader.dataset)}]")
+        print(f"batch loss: {batch_loss.item()} [{num_used_samples}/{num_samples}]")
         ep_loss = (ep_loss * b + batch_loss.item()) / (b + 1)
     return ep_loss
 
 
-def test(dataloader, model, loss_fn):
+def test(dataloader, model, loss_fn, memory_format=torch.contiguous_format):
     model.eval()
     ep_loss = 0.
-    with torch.no_grad():
+    with torch.no_grad():  # always FP32, so that modes compare fairly
         for b, (im, st, th) in enumerate(dataloader):
-            target = torch.stack((st, th), dim=-1)
-            feature, target = im.to(DEVICE), target.to(DEVICE)
+            feature, target = prepare_batch(im, st, th, memory_format)
             pred = model(feature)
             batch_loss = loss_fn(pred, target)
             ep_loss = (ep_loss * b + batch_loss.item()) / (b + 1)
     return ep_loss
 
 
+def save_atomic(obj, path):
+    """
+    torch.save() to a temporary file first, a crash never leaves half a file.
+    """
+    tmp_path = path + '.tmp'
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def rng_state(augmenter=None):
+    state = {
+        'torch': torch.get_rng_state(),
+        'numpy': np.random.get_state(),
+        'python': random.getstate(),
+    }
+    if DEVICE == "cuda":
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    if augmenter is not None:
+        state['augment'] = augmenter.generator.get_state()
+    return state
+
+
+def set_rng_state(state, augmenter=None):
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['python'])
+    if 'cuda' in state and DEVICE == "cuda":
+        torch.cuda.set_rng_state_all(state['cuda'])
+    if augmenter is not None and 'augment' in state:
+        augmenter.generator.set_state(state['augment'])
+
+
+def set_data_epoch(dataloader, epoch):
+    """
+    Samplers and streams draw their order from (seed, epoch), resuming sets
+    the epoch instead of saving their generators.
+    """
+    for source in (dataloader.sampler, dataloader.dataset):
+        if hasattr(source, 'epoch'):
+            source.epoch = epoch
+
+
+def fit(train_dataloader, test_dataloader, lr, epochs, amp=False, channels_last=False, augment_config=None,
+        checkpoint_path=None, resume=False, checkpoint_every=1, patience=None, min_delta=0., weight_decay=0.0001,
+        model_name='DonkeyNet'):
+    """
+    Train a fresh model (or resume one from checkpoint_path), return it with
+    the weights of its best test loss and the history: per-epoch losses and
+    wall-clock times, best epoch and loss by the min_delta rule.
+    Checkpoints hold everything needed to continue: model, optimizer, grad
+    scaler, losses, early stopping counters and RNG states.
+    """
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    amp_dtype = autocast_dtype(amp)
+    # a fresh generator per fit, so compared modes see the same augmentations
+    augmenter = augment.BatchAugment(DEVICE, **augment_config) if augment_config is not None else None
+    # choose the architecture from convnets.MODELS
+    model = convnets.make_model(model_name).to(DEVICE, memory_format=memory_format)
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr, weight_decay=weight_decay)
+    # scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=5, gamma=0.8)
+    if hasattr(torch.amp, 'GradScaler'):
+        scaler = torch.amp.GradScaler('cuda', enabled=amp_dtype == torch.float16)
+    else:  # torch < 2.3, as pinned in requirements.txt
+        scaler = torch.cuda.amp.GradScaler(enabled=amp_dtype == torch.float16)
+    loss_fn = nn.MSELoss()
+    history = {
+        'epoch': 0,  # completed epochs
+        'train_losses': [],
+        'test_losses': [],
+        'epoch_times': [],
+        'best_loss': float('inf'),
+        'best_epoch': 0,
+        'best_state': None,
+        'stopped': False,
+    }
+    if resume and checkpoint_path and os.path.isfile(checkpoint_path):
+        checkpoint = torch.load(checkpoint_path, map_location='cpu', weights_only=False)
+        model.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        scaler.load_state_dict(checkpoint['scaler'])
+        set_rng_state(checkpoint['rng'], augmenter)
+        history = checkpoint['history']
+        print(f"Resumed from {checkpoint_path} after epoch {history['epoch']}")
+    elif resume:
+        print(f"WARNING: --resume found no checkpoint at {checkpoint_path}, training from scratch")
+    set_data_epoch(train_dataloader, history['epoch'])
+
+    def save_checkpoint():
+        save_atomic({
+            'model': model.state_dict(),
+            'optimizer': optimizer.state_dict(),
+            'scaler': scaler.state_dict(),
+            'rng': rng_state(augmenter),
+            'history': history,
+        }, checkpoint_path)
+
+    for t in range(history['epoch'], epochs):
+        if history['stopped']:
+            break
+        print(f"Epoch {t+1}\n-------------------------------")
+        start_stamp = perf_counter()
+        ep_train_loss = train(
+            train_dataloader, model, loss_fn, optimizer, scaler, amp_dtype, memory_format, augmenter
+        )
+        if DEVICE == "cuda":
+            torch.cuda.synchronize()
+        history['epoch_times'].append(perf_counter() - start_stamp)
+        ep_test_loss = test(test_dataloader, model, loss_fn, memory_format)
+        print(f"epoch {t+1} training loss: {ep_train_loss}, testing loss: {ep_test_loss}, "
+              f"time: {history['epoch_times'][-1]:.2f} s")
+        current_lr = optimizer.param_groups[0]['lr']
+        print(f"Learning rate after scheduler step: {current_lr}")
+        # save values
+        history['train_losses'].append(ep_train_loss)
+        history['test_losses'].append(ep_test_loss)
+        history['epoch'] = t + 1
+        # Apply the learning rate scheduler after each epoch
+        # scheduler.step()
+        if ep_test_loss < history['best_loss'] - min_delta:
+            history['best_loss'] = ep_test_loss
+            history['best_epoch'] = t + 1
+            history['best_state'] = {k: v.detach().to('cpu', copy=True) for k, v in model.state_dict().items()}
+        elif patience is not None and t + 1 - history['best_epoch'] >= patience:
+            print(f"No better test loss for {patience} epochs, stop early")
+            history['stopped'] = True
+        if checkpoint_path and (history['stopped'] or (t + 1) % checkpoint_every == 0 or t + 1 == epochs):
+            save_checkpoint()
+    if history['best_state'] is not None:
+        print(f"Best test loss {history['best_loss']:.5f} at epoch {history['best_epoch']}")
+        model.load_state_dict(history['best_state'])
+    return model, history
+
+
 # MAIN
 # Create a dataset
-data_dir = os.path.join(os.path.dirname(sys.path[0]), 'data', data_datetime)
-annotations_file = os.path.join(data_dir, 'labels.csv')  # the name of the csv file
-img_dir = os.path.join(data_dir, 'images') # the name of the folder with all the images in it
-bearcart_dataset = BearCartDataset(annotations_file, img_dir)
-print(f"data length: {len(bearcart_dataset)}")
-
-# Create training dataloader and test dataloader
-train_size = round(len(bearcart_dataset)*0.9)
-test_size = len(bearcart_dataset) - train_size
-print(f"train size: {train_size}, test size: {test_size}")
-train_data, test_data = random_split(bearcart_dataset, [train_size, test_size])
-train_dataloader = DataLoader(train_data, batch_size=125)
-test_dataloader = DataLoader(test_data, batch_size=125)
-
-# Create model - Pass in image size
-model = convnets.DonkeyNet().to(DEVICE)  # choose the architecture class from cnn_network.py
-# Hyper-parameters (lr=0.001, epochs=10 | lr=0.0001, epochs=15 or 20)
-lr = 0.001
-optimizer = torch.optim.Adam(model.parameters(), lr=lr, weight_decay=0.0001)
-# scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=5, gamma=0.8)
-loss_fn = nn.MSELoss()
-epochs = 15 # switch back to 15 epochs
-# Optimize the model
-train_losses = []
-test_losses = []
-for t in range(epochs):
-    print(f"Epoch {t+1}\n-------------------------------")
-    ep_train_loss = train(train_dataloader, model, loss_fn, optimizer)
-    ep_test_loss = test(test_dataloader, model, loss_fn)
-    print(f"epoch {t+1} training loss: {ep_train_loss}, testing loss: {ep_test_loss}")
-    current_lr = optimizer.param_groups[0]['lr']
-    print(f"Learning rate after scheduler step: {current_lr}")
-    # save values
-    train_losses.append(ep_train_loss)
-    test_losses.append(ep_test_loss)
-    # Apply the learning rate scheduler after each epoch
-    # scheduler.step()
+data_root = os.path.join(os.path.dirname(sys.path[0]), 'data')
+data_dirs = [os.path.join(data_root, d) for d in args.data_datetime]
+data_dir = data_dirs[0]  # plot and model are saved with the first session, unless --out
+out_dir = args.out or data_dir
+if args.stream:
+    # Create training and test streams, the split is fixed per frame
+    train_data = sessions.StreamingSessionDataset(
+        data_dirs, 'train', weights=args.weights, shuffle_buffer=args.shuffle_buffer, raw=args.batch_collate
+    )
+    test_data = sessions.StreamingSessionDataset(data_dirs, 'test', raw=args.batch_collate)
+    print(f"train size: {len(train_data)}, test size: {len(test_data)}")
+else:
+    bearcart_dataset = ConcatDataset([
+        datasets.load_session(d, use_cache=not args.no_cache, raw=args.batch_collate) for d in data_dirs
+    ])
+    print(f"data length: {len(bearcart_dataset)}")
+
+    # Create training dataloader and test dataloader
+    train_data, test_data = datasets.split_dataset(bearcart_dataset, .1, args.seed)
+    print(f"train size: {len(train_data)}, test size: {len(test_data)}")
+loader_kwargs = {
+    'batch_size': args.batch_size,
+    'num_workers': args.workers,
+    'pin_memory': DEVICE == "cuda" and not args.no_pin_memory,
+    'prefetch_factor': args.prefetch,
+    'batch_collate': args.batch_collate,
+}
+train_sampler = None
+run_lengths = None if args.stream else samplers.dataset_run_lengths(train_data)
+if args.balance or args.epoch_samples or (run_lengths is not None and args.run_power):
+    # without --balance the label weights are uniform (power 0)
+    train_sampler = samplers.BalancedSampler(
+        samplers.dataset_labels(train_data),
+        num_samples=args.epoch_samples,
+        bins=tuple(args.balance_bins),
+        power=args.balance_power if args.balance else 0.,
+        run_lengths=run_lengths,
+        run_power=args.run_power,
+    )
+    print(f"train samples per epoch: {len(train_sampler)}")
+train_dataloader = datasets.make_dataloader(train_data, sampler=train_sampler, **loader_kwargs)
+test_dataloader = datasets.make_dataloader(test_data, **loader_kwargs)
+
+# Hyper-parameters (lr=0.001, epochs=10 | lr=0.0001, epochs=15 or 20), sweep.py searches them
+lr = args.lr
+epochs = args.epochs
+pilot_title = f'{args.model}-{epochs}epochs-{lr}lr'  # inference.load_model() reads the model from it
+run_title = f'{args.model}-{lr}lr'  # checkpoints leave out epochs, --resume may extend the run
+checkpoint_dir = os.path.join(out_dir, 'checkpoints')
+os.makedirs(checkpoint_dir, exist_ok=True)
+# Optimize the model, the last mode in the list is the one saved
+modes = []
+if args.compare or not (args.amp or args.channels_last):
+    modes.append(('fp32', False, False))
+if args.amp or args.channels_last:
+    mode_name = '+'.join(name for name, on in (('amp', args.amp), ('channels_last', args.channels_last)) if on)
+    modes.append((mode_name, args.amp, args.channels_last))
+results = {}
+for mode_name, amp, channels_last in modes:
+    print(f"Training mode: {mode_name}")
+    torch.manual_seed(args.seed)  # same initial weights in every mode
+    checkpoint_path = os.path.join(checkpoint_dir, f'{run_title}-{mode_name}.ckpt')
+    try:
+        model, history = fit(
+            train_dataloader, test_dataloader, lr, epochs, amp=amp, channels_last=channels_last,
+            augment_config=augment_config, checkpoint_path=checkpoint_path, resume=args.resume,
+            checkpoint_every=args.checkpoint_every, patience=args.patience, min_delta=args.min_delta,
+            weight_decay=args.weight_decay, model_name=args.model,
+        )
+    except KeyboardInterrupt:
+        print(f"Interrupted, continue from the last checkpoint with: python train.py {' '.join(sys.argv[1:])}"
+              f"{'' if args.resume else ' --resume'}")
+        sys.exit(1)
+    train_losses, test_losses, epoch_times = history['train_losses'], history['test_losses'], history['epoch_times']
+    results[mode_name] = (sum(epoch_times) / len(epoch_times), history['best_loss'])
 
 print("Optimize Done!")
+for mode_name, (epoch_time, best_mse) in results.items():
+    print(f"{mode_name:>20}: mean epoch time {epoch_time:.2f} s, best test MSE {best_mse:.5f}")
 
 # Graph training process
-pilot_title = f'{model._get_name()}-{epochs}epochs-{lr}lr'
-plt.plot(range(epochs), train_losses, 'b--', label='Training')
-plt.plot(range(epochs), test_losses, 'orange', label='Test')
+plt.plot(range(len(train_losses)), train_losses, 'b--', label='Training')
+plt.plot(range(len(test_losses)), test_losses, 'orange', label='Test')
 plt.xlabel('Epoch')
 plt.ylabel('MSE Loss')
 plt.legend()
 plt.title(pilot_title)
-plt.savefig(os.path.join(data_dir, f'{pilot_title}.png'))
-# Save the model
-torch.save(model.state_dict(), os.path.join(data_dir, f'{pilot_title}.pth'))
\ No newline at end of file
+plt.savefig(os.path.join(out_dir, f'{pilot_title}.png'))
+# Save the model, with the weights of the best epoch
+model = model.to(memory_format=torch.contiguous_format)
+torch.save(model.state_dict(), os.path.join(out_dir, f'{pilot_title}.pth'))
+# Save the losses, sweep.py reads them
+with open(os.path.join(out_dir, f'{pilot_title}.json'), 'w') as f:
+    json.dump({
+        'model': args.model,
+        'lr': lr,
+        'weight_decay': args.weight_decay,
+        'batch_size': args.batch_size,
+        'epochs': epochs,
+        'epochs_run': len(test_losses),
+        'best_epoch': history['best_epoch'],  # the saved weights, min_delta applied
+        'best_test_loss': history['best_loss'],
+        'mean_epoch_time': sum(epoch_times) / len(epoch_times),
+        'train_losses': train_losses,
+        'test_losses': test_losses,
+    }, f, indent=4)
\ No newline at end of file
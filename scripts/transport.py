@@ -0,0 +1,127 @@
+"""
+Non-blocking serial link to the Pico.
+send() only drops the command into a single-slot mailbox, a writer thread
+transmits the newest one, so a slow USB write never stalls the control loop
+and stale commands are coalesced away. A reader thread drains everything the
+Pico prints, parses acks and measures the command -> PWM applied round trip,
+and keeps the Pico's latest status report (loop rate, GC activity).
+Commands sent with a tag (the frame id) have their USB write recorded as
+'serial write' in telemetry, if one is attached (see telemetry.py).
+"""
+import threading
+from time import perf_counter
+from pipeline import LatestSlot
+import protocol
+
+
+class SerialTransport:
+    def __init__(self, ser, encoder, max_rtts=1000):
+        self.ser = ser
+        if ser.timeout is None:
+            ser.timeout = .1  # reads must return now and then to notice close()
+        self.encoder = encoder
+        self.sent = 0
+        self.acks = 0
+        self.other_lines = 0  # debug prints and anything else from the Pico
+        self.last_line = None
+        self.pico_status = None  # latest status line from the Pico, as a dict
+        self.rtts = []  # seconds, latest max_rtts only
+        self.max_rtts = max_rtts
+        self.telemetry = None
+        self._send_stamps = [None] * 256  # by sequence number
+        self._slot = LatestSlot()
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name='serial-writer', daemon=True)
+        self._reader = threading.Thread(target=self._read_loop, name='serial-reader', daemon=True)
+        self._writer.start()
+        self._reader.start()
+
+    @property
+    def name(self):
+        return self.ser.name
+
+    def send(self, duty_st, duty_th, tag=None):
+        """
+        Queue a command, replacing one that has not been written yet. Never blocks.
+        """
+        self._slot.put((duty_st, duty_th, tag))
+
+    def _write_loop(self):
+        while True:
+            command = self._slot.get(timeout=.1)
+            if command is None:
+                if self._stop.is_set():
+                    return
+                continue
+            duty_st, duty_th, tag = command
+            seq = getattr(self.encoder, 'seq', None)  # text commands are not acked
+            msg = self.encoder.encode(duty_st, duty_th)
+            t0 = perf_counter()
+            if seq is not None:
+                self._send_stamps[seq] = t0
+            self.ser.write(msg)
+            self.sent += 1
+            if tag is not None and self.telemetry is not None:
+                self.telemetry.record(tag, 'serial write', t0, perf_counter())
+
+    def _read_loop(self):
+        buffer = b''
+        while not self._stop.is_set():
+            data = self.ser.read(self.ser.in_waiting or 1)  # returns early on the port timeout
+            if not data:
+                continue
+            now = perf_counter()
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                seq = protocol.parse_ack(line)
+                if seq is None:
+                    status = protocol.parse_status(line)
+                    if status is not None:
+                        self.pico_status = status
+                        continue
+                    self.other_lines += 1
+                    self.last_line = line
+                    continue
+                self.acks += 1
+                stamp = self._send_stamps[seq]
+                if stamp is not None:
+                    self._send_stamps[seq] = None
+                    self.rtts.append(now - stamp)
+                    if len(self.rtts) > self.max_rtts:
+                        del self.rtts[:-self.max_rtts]
+
+    @property
+    def coalesced(self):
+        """
+        Commands replaced by a newer one before they were written.
+        """
+        return self._slot.dropped
+
+    def stats(self):
+        summary = {
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'acks': self.acks,
+            'other_lines': self.other_lines,
+        }
+        rtts = sorted(self.rtts)
+        if rtts:
+            summary['rtt_ms'] = {
+                'p50': 1000 * rtts[len(rtts) // 2],
+                'p95': 1000 * rtts[min(len(rtts) - 1, int(len(rtts) * .95))],
+                'max': 1000 * rtts[-1],
+            }
+        if self.pico_status is not None:
+            summary['pico'] = self.pico_status
+        return summary
+
+    def close(self):
+        """
+        Write the command still queued, if any, then release the port.
+        """
+        self._slot.close()  # no more commands, the queued one is still handed out
+        self._stop.set()
+        self._writer.join(1.)
+        self._reader.join(1.)
+        self.ser.close()
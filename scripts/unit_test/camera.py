@@ -2,9 +2,11 @@
 If ssh from other machine, please enable X11 forwarding, either `ssh -X` or `ssh -Y`
 """
 import sys
+import os
 import cv2
-from picamera2 import Picamera2
 from time import sleep
+sys.path.append(os.path.dirname(sys.path[0]))
+import hardware
 
 # SETUP
 print("Please adjust lens focus if blurry")
@@ -12,8 +14,7 @@ for i in reversed(range(1, 4)):
     print(i)
     sleep(1)
 cv2.startWindowThread()
-picam2 = Picamera2()
-picam2.configure(picam2.create_preview_configuration(main={"format": 'RGB888', "size": (640, 480)}))
+picam2 = hardware.PiCamera(size=(640, 480), fps=None)
 picam2.start()
 
 # LOOP
@@ -23,5 +24,6 @@ while True:
     cv2.imshow("Camera", im)
     # Press "q" to quit
     if cv2.waitKey(1)==ord('q'):
+        picam2.close()
         cv2.destroyAllWindows()
         sys.exit()
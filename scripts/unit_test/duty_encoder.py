@@ -0,0 +1,77 @@
+"""
+Check hardware.DutyEncoder against the original dutycycle formula and time it.
+No hardware needed.
+"""
+import sys
+import os
+import json
+from time import perf_counter
+import numpy as np
+sys.path.append(os.path.dirname(sys.path[0]))
+import hardware
+
+# SETUP
+params_file_path = os.path.join(os.path.dirname(sys.path[0]), 'configs.json')
+params = json.load(open(params_file_path))
+STEERING_CENTER = params['steering_center']
+STEERING_RANGE = params['steering_range']
+THROTTLE_STALL = params['throttle_stall']
+THROTTLE_FWD_RANGE = params['throttle_fwd_range']
+THROTTLE_REV_RANGE = params['throttle_rev_range']
+THROTTLE_LIMIT = params['throttle_limit']
+
+
+def reference(act_st, act_th):
+    """
+    The formula collect_data.py used to inline.
+    """
+    duty_st = STEERING_CENTER - STEERING_RANGE + int(STEERING_RANGE * (act_st + 1))
+    if act_th > 0:
+        duty_th = THROTTLE_STALL + int(THROTTLE_FWD_RANGE * min(act_th, THROTTLE_LIMIT))
+    elif act_th < 0:
+        duty_th = THROTTLE_STALL + int(THROTTLE_REV_RANGE * max(act_th, -THROTTLE_LIMIT))
+    else:
+        duty_th = THROTTLE_STALL
+    return duty_st, duty_th
+
+
+duty = hardware.DutyEncoder(params)
+step = 2. / (duty.resolution - 1)
+
+# LOOP
+# 1. joystick values (2 decimals) land on the table: same dutycycles, give or take float rounding
+grid = [round(i / 100 - 1, 2) for i in range(201)]
+errors = [np.subtract(duty.encode(a, b), reference(a, b)) for a in grid for b in grid]
+max_error = np.abs(errors).max(axis=0)
+assert (max_error <= 1).all(), max_error
+print(f"joystick grid: max error (steering, throttle) {max_error.tolist()} ns")
+# 2. any other action is off by at most half a table step
+rng = np.random.default_rng(0)
+actions = rng.uniform(-1, 1, (10000, 2))
+expected = np.array([reference(a, b) for a, b in actions])
+bound = np.array([STEERING_RANGE, THROTTLE_FWD_RANGE]) * step / 2 + 1
+max_error = np.abs(np.array([duty.encode(a, b) for a, b in actions]) - expected).max(axis=0)
+assert (max_error <= bound).all(), (max_error, bound)
+print(f"random actions: max error {max_error.tolist()} ns, bound {bound.tolist()} ns")
+# 3. batches match one by one, out of range actions are clipped
+actions = np.concatenate([actions, [[-3., 3.], [1., -1.], [0., 0.]]])
+batch_st, batch_th = duty.encode_batch(actions[:, 0], actions[:, 1])
+assert (np.stack([batch_st, batch_th], axis=1) == [duty.encode(a, b) for a, b in actions]).all()
+assert duty.encode(-3., 3.) == reference(-1., 1.)
+print("batch: OK")
+# 4. a straight calibration curve changes nothing, a bent one moves the center
+straight = hardware.DutyEncoder(dict(params, steering_calibration=[[-1, -1], [1, 1]]))
+assert (straight.steering_table == duty.steering_table).all()
+trimmed = hardware.DutyEncoder(dict(params, steering_calibration=[[-1, -1], [0, .1], [1, 1]]))
+assert trimmed.encode(0., 0.)[0] == reference(.1, 0.)[0]
+print(f"calibration: center moved from {duty.encode(0., 0.)[0]} to {trimmed.encode(0., 0.)[0]} ns")
+# 5. timing
+samples = actions[:10000].tolist()
+for name, fn in (('formula', reference), ('table', duty.encode)):
+    start_stamp = perf_counter()
+    for a, b in samples:
+        fn(a, b)
+    print(f"{name}: {1e6 * (perf_counter() - start_stamp) / len(samples):.2f} us/action")
+start_stamp = perf_counter()
+duty.encode_batch(actions[:10000, 0], actions[:10000, 1])
+print(f"batch: {1e6 * (perf_counter() - start_stamp) / 10000:.3f} us/action")
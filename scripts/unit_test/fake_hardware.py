@@ -0,0 +1,51 @@
+"""
+Drive the fake hardware: replay a recorded session as fast as possible,
+steer with a scripted controller and collect the serial output in memory.
+Stage timings are reported and saved as a Chrome trace (fake_hardware.json).
+No hardware needed, e.g. python fake_hardware.py 2022-02-22-22-22
+"""
+import sys
+import os
+import json
+from time import perf_counter
+sys.path.append(os.path.dirname(sys.path[0]))
+import hardware
+import telemetry
+
+# SETUP
+session_dir = os.path.join(os.path.dirname(os.path.dirname(sys.path[0])), 'data', sys.argv[1])
+params = json.load(open(os.path.join(os.path.dirname(sys.path[0]), 'configs.json')))
+rig = hardware.open_rig(params, replay=session_dir, fps=0)
+duty = hardware.DutyEncoder(params)
+stage_times = telemetry.Telemetry(('capture', 'encode', 'serial write'))
+rig.drivetrain.attach(stage_times)
+print(f"Replaying {len(rig.camera)} frames from {session_dir}")
+rig.controller.press(params['record_btn'])
+count = 0
+start_stamp = perf_counter()
+
+# LOOP
+while True:
+    t0 = perf_counter()
+    frame = rig.camera.capture_array()
+    if frame is None:  # end of the session
+        break
+    stage_times.record(count, 'capture', t0, perf_counter())
+    for button in rig.controller.update():
+        if button == params['record_btn']:
+            rig.light.toggle()
+    st, th = frame.mean() / 127.5 - 1., -.1  # anything that depends on the frame
+    t0 = perf_counter()
+    duty_st, duty_th = duty.encode(st, th)
+    stage_times.record(count, 'encode', t0, perf_counter())
+    rig.drivetrain.send(duty_st, duty_th, count)
+    count += 1
+elapsed = perf_counter() - start_stamp
+assert rig.light.is_lit
+print(f"{count} frames in {elapsed:.2f} s: {count / elapsed:.0f} Hz, serial: {rig.drivetrain.stats()}")
+drivetrain = rig.drivetrain
+rig.close()
+print(stage_times.report())
+print(f"{stage_times.export_chrome_trace('fake_hardware.json')} trace events saved to fake_hardware.json")
+assert drivetrain.last_command() == tuple(drivetrain.neutral), drivetrain.last_command()
+print(f"Closed, last command sent: {drivetrain.last_command()} (neutral)")
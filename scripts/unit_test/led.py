@@ -2,7 +2,8 @@ import sys
 import os
 import json
 from time import sleep
-from gpiozero import LED
+sys.path.append(os.path.dirname(sys.path[0]))
+import hardware
 
 # Load configs
 params_file_path = os.path.join(os.path.dirname(sys.path[0]), 'configs.json')
@@ -10,10 +11,11 @@ params_file = open(params_file_path)
 params = json.load(params_file)
 
 # SETUP
-led = LED(params['led_pin'])
+led = hardware.HeadLight(params['led_pin'])
 
 for _ in range(10):
     led.on()
     sleep(1)
     led.off()
     sleep(1)
+led.close()
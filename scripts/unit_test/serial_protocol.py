@@ -0,0 +1,117 @@
+"""
+Check the Pi encoder against the Pico decoder over a pseudo terminal pair.
+No hardware needed: the decoder runs on the host under CPython.
+"""
+import sys
+import os
+import pty
+import tty
+import threading
+from time import perf_counter, sleep
+import serial
+sys.path.append(os.path.dirname(sys.path[0]))
+import protocol
+
+# SETUP
+master_fd, slave_fd = pty.openpty()
+tty.setraw(slave_fd)  # no line discipline, bytes go through untouched
+ser = serial.Serial(port=os.ttyname(slave_fd), baudrate=115200)
+print(f"Fake Pico is listening on: {ser.name}")
+decoder = protocol.CommandDecoder()
+received = []
+
+
+def listen():
+    while True:
+        data = os.read(master_fd, 4096)
+        for byte in data:
+            if decoder.feed(byte):
+                received.append((decoder.steering, decoder.throttle))
+
+
+threading.Thread(target=listen, daemon=True).start()
+commands = [(1000000 + 1000 * i, 1090000 + 700 * i) for i in range(1000)]
+
+# LOOP
+# 1. every command arrives intact, with either protocol
+for name in protocol.PROTOCOLS:
+    received.clear()
+    encoder = protocol.make_encoder(name)
+    num_bytes = 0
+    for duty_st, duty_th in commands:
+        num_bytes += ser.write(encoder.encode(duty_st, duty_th))
+    ser.flush()
+    sleep(.5)
+    assert received == commands, f"{name}: {len(received)}/{len(commands)} commands decoded correctly"
+    # parse time per message, on this host
+    stream = b''.join(encoder.encode(duty_st, duty_th) for duty_st, duty_th in commands)
+    start_stamp = perf_counter()
+    protocol.decode_all(stream)
+    parse_us = 1e6 * (perf_counter() - start_stamp) / len(commands)
+    print(f"{name}: OK, {num_bytes / len(commands):.1f} bytes/message, parse {parse_us:.1f} us/message")
+
+# 2. corrupted and partial binary frames are dropped, the stream recovers
+encoder = protocol.make_encoder('binary')
+good = encoder.encode(1500000, 1210000)
+corrupted = bytearray(encoder.encode(1999999, 1210000))
+corrupted[5] ^= 0x10  # flip one bit in the steering value
+partial = encoder.encode(1000000, 1800000)[:7]
+commands, dec = protocol.decode_all(good + bytes(corrupted) + partial + good)
+assert commands == [(1500000, 1210000), (1500000, 1210000)], commands
+print(f"binary: corrupted and partial frames dropped, {dec.num_errors} errors detected")
+
+# 3. garbled text lines are dropped
+commands, dec = protocol.decode_all(b"1500000,1210000\n15000x0,1210000\n1500000\n1400000,1210000\n")
+assert commands == [(1500000, 1210000), (1400000, 1210000)], commands
+print(f"text: garbled lines dropped, {dec.num_errors} errors detected")
+
+# 4. the Pico's ring reads: chunks of any size, wrapping around the ring, latest command wins
+encoder = protocol.make_encoder('binary')
+commands = [(1000000 + 1000 * i, 1090000 + 700 * i) for i in range(300)]
+stream = b''.join(encoder.encode(duty_st, duty_th) for duty_st, duty_th in commands)
+ring = bytearray(protocol.RING_SIZE)
+dec = protocol.CommandDecoder()
+head = tail = pos = num_commands = 0
+latest = []
+while pos < len(stream):
+    chunk = 1 + pos % (protocol.RING_SIZE - 1)  # never fill the ring, like the firmware
+    for byte in stream[pos:pos + chunk]:
+        ring[head] = byte
+        head = (head + 1) % protocol.RING_SIZE
+    pos += chunk
+    num_new = dec.feed_ring(ring, tail, head)
+    tail = head
+    if num_new:
+        num_commands += num_new
+        latest.append((dec.steering, dec.throttle))
+assert num_commands == len(commands) and latest[-1] == commands[-1], (num_commands, latest[-1])
+print(f"ring: {num_commands} commands in {len(latest)} reads, latest applied")
+
+# 5. status lines round trip
+status = protocol.StatusLine()
+values = [5210, 100, 3, 412, 183456, 10 ** 9]
+for field, value in enumerate(values):
+    status.set(field, value)
+parsed = protocol.parse_status(bytes(status.line))
+assert list(parsed.values()) == values[:-1] + [10 ** protocol.STATUS_WIDTH - 1], parsed
+assert protocol.parse_status(b"A012\n") is None and protocol.parse_ack(bytes(status.line)) is None
+print(f"status: {bytes(status.line)} -> {parsed}")
+
+# 6. every byte value, 0x03 (Ctrl-C on the Pico's stdin) included, is plain data:
+# two full sequence number wraps, the low dutycycle bytes run through 0-255 as well
+encoder = protocol.make_encoder('binary')
+commands = [(1000000 + i, 1090000 + 257 * i) for i in range(512)]
+stream = b''.join(encoder.encode(duty_st, duty_th) for duty_st, duty_th in commands)
+assert set(stream) == set(range(256)), f"{256 - len(set(stream))} byte values never sent"
+decoded, dec = protocol.decode_all(stream)
+assert decoded == commands and dec.num_errors == 0, (len(decoded), dec.num_errors)
+assert not dec.interrupted, "0x03 inside a frame taken for Ctrl-C"
+print(f"all byte values: {len(decoded)} commands decoded, {stream.count(3)} 0x03 bytes, seq wrapped twice")
+
+# 7. a Ctrl-C between frames or in a text line interrupts, as an IDE sends it to stop main.py
+for stream in (b'\r\x03', encoder.encode(*commands[3]) + b'\x03', b'1500000,12\x03'):
+    decoded, dec = protocol.decode_all(stream)
+    assert dec.interrupted, stream
+print("ctrl-c: interrupts between frames and in text lines")
+ser.close()
+os.close(master_fd)
@@ -0,0 +1,64 @@
+"""
+Exercise the non-blocking serial transport against a fake Pico over a
+pseudo terminal pair. The fake Pico decodes commands and acks them the way
+pico/dutycycle_listener.py does. No hardware needed.
+"""
+import sys
+import os
+import pty
+import tty
+import threading
+from time import sleep
+import serial
+sys.path.append(os.path.dirname(sys.path[0]))
+import protocol
+import transport
+
+# SETUP
+master_fd, slave_fd = pty.openpty()
+tty.setraw(slave_fd)
+tty.setraw(master_fd)
+ser_pico = transport.SerialTransport(
+    serial.Serial(port=os.ttyname(slave_fd), baudrate=115200),
+    protocol.make_encoder('binary'),
+)
+print(f"Fake Pico is connected to port: {ser_pico.name}")
+decoder = protocol.CommandDecoder()
+status = protocol.StatusLine()
+applied = []
+
+
+def fake_pico():
+    while True:
+        data = os.read(master_fd, 4096)
+        for byte in data:
+            if decoder.feed(byte):
+                applied.append((decoder.steering, decoder.throttle))
+                os.write(master_fd, b"debug line the Pi should drain\n")
+                os.write(master_fd, decoder.make_ack())
+                status.set(1, len(applied))
+                os.write(master_fd, status.line)
+
+
+threading.Thread(target=fake_pico, daemon=True).start()
+
+# LOOP
+# 1. paced like the control loop: every command is sent and acked
+for i in range(100):
+    ser_pico.send(1500000 + i, 1210000)
+    sleep(.01)
+sleep(.2)
+stats = ser_pico.stats()
+print(f"paced: {stats}")
+assert stats['acks'] == stats['sent'] == len(applied)
+# 2. a burst: old commands are coalesced, the newest one always arrives
+applied.clear()
+for i in range(10000):
+    ser_pico.send(1000000 + i, 1210000)
+sleep(.2)
+stats = ser_pico.stats()
+print(f"burst: {len(applied)} of 10000 commands written, {stats}")
+assert applied[-1] == (1000000 + 9999, 1210000)
+assert stats['pico']['commands'] == len(applied)
+ser_pico.close()
+os.close(master_fd)
@@ -1,18 +1,25 @@
-import serial
+"""
+Check the USB serial link to the Pico: send the neutral command once a second
+and print what came back, acks, round trip times and the Pico's status line.
+Nothing moves, steering stays centered and throttle stalled.
+"""
+import sys
+import os
+import json
 from time import sleep
+sys.path.append(os.path.dirname(sys.path[0]))
+import hardware
 
 # SETUP
-ser = serial.Serial(port='/dev/ttyACM0', baudrate=115200)
-print(ser.name)
+params_file_path = os.path.join(os.path.dirname(sys.path[0]), 'configs.json')
+params_file = open(params_file_path)
+params = json.load(params_file)
+rig = hardware.open_rig(params, camera=False, controller=False, light=False)
+print(f"Pico is connected to port: {rig.drivetrain.name}")
 
 # LOOP
 for i in range(10):
-    msg = f"Hello from RPi: {i}\n".encode('utf-8')
-    ser.write(msg)
-    # print("Transmitting")
+    rig.drivetrain.stop()  # the neutral command
     sleep(1)
-    if ser.inWaiting() > 0:
-        pico_data = ser.readline()
-        pico_data = pico_data.decode('utf-8', 'ignore')
-        print(pico_data)
-ser.close()
+    print(f"{i}: {rig.drivetrain.stats()}")
+rig.close()